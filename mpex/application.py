@@ -1,5 +1,7 @@
 import io
+import json
 import os.path
+import shutil
 import subprocess
 # check python version
 import sys
@@ -8,10 +10,13 @@ if sys.version_info < (3, 2, 0):
     raise RuntimeError("Python version >= 3.2 is needed.")
 
 from . import local_repository
+from . import structure_base
 from . import structure_host
 from . import structure_annex
 from . import structure_repository
 from . import structure_connection
+from .lib import parallel
+from .lib import ssh_pool
 from .lib.terminal import print_red
 
 
@@ -27,33 +32,107 @@ class Application:
 
     InterruptedException = InterruptedException
 
-    def __init__(self, path, verbose=True, simulate=False):
+    # file in the config directory which caches the capabilities of git-annex
+    CAPABILITIES_FILENAME = "git_annex_capabilities"
+
+    def __init__(self, path, verbose=True, simulate=False, connect_timeout=None,
+                 connection_ttl=0, refresh_connections=False, ssh_multiplexing=False, lazy=False):
+        """
+            lazy: load the collections on first use and do not check the files expressions
+                  (the caller checks the annexes it uses with repositories.check)
+        """
         # save option
         self.path = path
+        self.lazy = lazy
         self.verbose = verbose
         self.simulate = simulate
+        self.connect_timeout = connect_timeout
+
+        # shared ssh master connections
+        self.ssh_pool = ssh_pool.SSHPool(enabled=ssh_multiplexing)
 
-        # initialise hosts
-        self.hosts = structure_host.Hosts(self)
-        # initialise annexes
-        self.annexes = structure_annex.Annexes(self)
-        # initialise repositories
-        self.repositories = structure_repository.Repositories(self)
-        # initialise connections
-        self.connections = structure_connection.Connections(self)
+        # persistent store of the connection status
+        self.reachability = structure_connection.ReachabilityStore(self, ttl=connection_ttl,
+                                                                   refresh=refresh_connections)
 
-        # post load checks
-        self.repositories.check()
+        # storage of the collections
+        self.config_store = structure_base.ConfigStore(path)
+
+        # the collections, created on first use
+        self._hosts = None
+        self._annexes = None
+        self._repositories = None
+        self._connections = None
+
+        if not lazy:
+            # load everything
+            self.collections()
+            # post load checks
+            self.repositories.check()
 
         # we want to have a new version
         assert self.git_annex_capabilities["date"] >= (2014, 1, 1)
 
+    @property
+    def hosts(self):
+        if self._hosts is None:
+            self._hosts = structure_host.Hosts(self)
+        return self._hosts
+
+    @property
+    def annexes(self):
+        if self._annexes is None:
+            self._annexes = structure_annex.Annexes(self)
+        return self._annexes
+
+    @property
+    def repositories(self):
+        # repositories refer to hosts and annexes, these are loaded on the way
+        if self._repositories is None:
+            self._repositories = structure_repository.Repositories(self)
+        return self._repositories
+
+    @property
+    def connections(self):
+        if self._connections is None:
+            self._connections = structure_connection.Connections(self)
+        return self._connections
+
     def save(self):
-        """ saves all data """
-        self.hosts.save()
-        self.annexes.save()
-        self.repositories.save()
-        self.connections.save()
+        """ saves all data (of the loaded collections) """
+        for collection in (self._hosts, self._annexes, self._repositories, self._connections):
+            if collection is not None:
+                collection.save(flush=False)
+        # write the snapshot only once
+        self.config_store.flush()
+
+    def rekey(self):
+        """ recompute keys and indexes of the loaded collections after an (unsafe) edit """
+        for collection in (self._hosts, self._annexes, self._repositories, self._connections):
+            if collection is not None:
+                collection.rekey()
+
+    def edited(self, obj):
+        """
+            an (unsafe) edit changed the host, annex, repository or connection obj: recompute keys
+            and indexes and mark obj and all objects referring to it (e.g. by the host name) as changed
+        """
+        self.rekey()
+        for collection in (self._hosts, self._annexes, self._repositories, self._connections):
+            if collection is None:
+                continue
+            for other in collection.get_all():
+                # the indexed values are the references to other objects
+                if other is obj or any(value is obj for value in collection.index_values(other).values()):
+                    collection.changed(other)
+
+    def collections(self):
+        """ all collections, in the order they have to be loaded """
+        return [self.hosts, self.annexes, self.repositories, self.connections]
+
+    def migrate_config_store(self, layout):
+        """ converts the stored data to the layout (see ConfigStore) """
+        self.config_store.migrate(layout, [(c.file_prefix, c.items()) for c in self.collections()])
 
     def current_host(self):
         """ get the current host """
@@ -111,6 +190,74 @@ class Application:
         if hasattr(self, "_gitAnnexCapabilities_Cache"):
             return self._gitAnnexCapabilities_Cache
 
+        # the persistent cache is valid as long as the same git-annex binary is installed
+        stamp = self.git_annex_stamp()
+        capabilities = self._load_git_annex_capabilities(stamp)
+        if capabilities is None:
+            capabilities = self._read_git_annex_capabilities()
+            self._save_git_annex_capabilities(stamp, capabilities)
+
+        # cache it
+        self._gitAnnexCapabilities_Cache = capabilities
+
+        # return
+        return capabilities
+
+    @staticmethod
+    def git_annex_stamp():
+        """ identifies the installed git-annex binary: its path and mtime (or None if it cannot be found) """
+        binary = shutil.which("git-annex")
+        if binary is None:
+            return None
+        binary = os.path.realpath(binary)
+        return {"path": binary, "mtime": os.stat(binary).st_mtime_ns}
+
+    @property
+    def git_annex_capabilities_path(self):
+        return os.path.join(self.path, self.CAPABILITIES_FILENAME)
+
+    def _load_git_annex_capabilities(self, stamp):
+        """ returns the stored capabilities, if they belong to the binary given by stamp, otherwise None """
+        if stamp is None:
+            return None
+        try:
+            with io.open(self.git_annex_capabilities_path, mode="rt", encoding="UTF8") as fd:
+                raw_data = json.load(fd)
+
+            if raw_data.get("stamp") != stamp:
+                return None
+
+            capabilities = raw_data["capabilities"]
+            assert isinstance(capabilities["version"], str)
+            assert isinstance(capabilities["jobs"], bool)
+            capabilities["date"] = tuple(int(x) for x in capabilities["date"])
+            assert len(capabilities["date"]) == 3
+        except (IOError, ValueError, KeyError, TypeError, AttributeError, AssertionError):
+            # a missing or broken cache is an empty cache
+            return None
+
+        return capabilities
+
+    def _save_git_annex_capabilities(self, stamp, capabilities):
+        """ stores the capabilities of the binary given by stamp """
+        if stamp is None:
+            return
+        raw_json = json.dumps({"stamp": stamp, "capabilities": capabilities}, ensure_ascii=False, indent=4,
+                              sort_keys=True)
+
+        # write to a temporary file and rename it, so concurrent runs never see a partial file
+        tmp_path = "%s.%d.tmp" % (self.git_annex_capabilities_path, os.getpid())
+        try:
+            with io.open(tmp_path, mode="wt", encoding="UTF8") as fd:
+                fd.write(raw_json)
+            os.replace(tmp_path, self.git_annex_capabilities_path)
+        except OSError:
+            # the cache is an optimisation only
+            pass
+
+    @staticmethod
+    def _read_git_annex_capabilities():
+        """ calls 'git-annex version' and parses the output """
         capabilities = {}
 
         # call git annex
@@ -132,16 +279,19 @@ class Application:
         year, month, day = int(year), int(month), int(day)
         capabilities["date"] = year, month, day
 
-        # cache it
-        self._gitAnnexCapabilities_Cache = capabilities
+        # parallel transfers (-J/--jobs)
+        capabilities["jobs"] = capabilities["date"] >= (2015, 11, 16)
 
-        # return
         return capabilities
 
-    def execute_command(self, cmd, ignore_exception=False, print_ignored_exception=True):
-        """ print and execute the command """
+    def execute_command(self, cmd, ignore_exception=False, print_ignored_exception=True, cwd=None,
+                        display_cmd=None):
+        """
+            print and execute the command (in the directory cwd, if given),
+            display_cmd is printed instead of cmd, if given
+        """
         if self.verbose <= self.VERBOSE_IMPORTANT:
-            print("command:", " ".join(cmd))
+            print("command:", " ".join(cmd if display_cmd is None else display_cmd))
 
         # if we only simulate, return
         if self.simulate:
@@ -150,7 +300,8 @@ class Application:
 
         try:
             with open(os.devnull, "w") as devnull:
-                subprocess.check_call(cmd, stdout=None if self.verbose <= self.VERBOSE_NORMAL else devnull)
+                parallel.check_call(cmd, cwd=cwd, env=self.ssh_pool.environment(),
+                                    stdout=None if self.verbose <= self.VERBOSE_NORMAL else devnull)
         except (subprocess.CalledProcessError, OSError) as e:
             if ignore_exception:
                 if print_ignored_exception:
@@ -158,3 +309,23 @@ class Application:
             else:
                 print_red("an error occurred:", str(e))
                 raise InterruptedException(e)
+
+    def execute_command_streamed(self, cmd, prefix):
+        """
+            print and execute the command, its output is streamed line by line
+            with the given prefix, returns the exit status (None if the command
+            was not executed)
+        """
+        if self.verbose <= self.VERBOSE_IMPORTANT:
+            print(prefix + "command:", " ".join(cmd))
+
+        # if we only simulate, return
+        if self.simulate:
+            print(prefix + "simulation: command not executed")
+            return None
+
+        try:
+            return parallel.call_prefixed(cmd, prefix, quiet=self.verbose > self.VERBOSE_NORMAL)
+        except OSError as e:
+            print_red("an error occurred:", str(e))
+            return None
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
+import array
 import collections
+import concurrent.futures
+import csv
+import io
 import json
 import os
+import queue
 import subprocess
+import sys
+import tempfile
+
+from . import location_index
 
 
 def check_output_no_ret(*popenargs, **kwargs):
@@ -20,27 +29,50 @@ def annex_whereis(path):
     """
     capture the output of 'git annex whereis'
     """
-    os.chdir(path)
     cmd = ["git-annex", "whereis", "--json"]
-    return check_output_no_ret(cmd)
+    return check_output_no_ret(cmd, cwd=path)
 
 
-def parse_annex_whereis(raw, omit_untrusted=False):
+def stream_annex_whereis(path):
     """
-    parse 'git annex whereis --json' output,
-    returns a dictionary with the filename -> uuid association
-    and a dictionary with the uuids > description association
+    yields the output lines of 'git annex whereis' while the command runs,
+    raises CalledProcessError if the command fails without any output (whereis
+    also fails if single files have no copy, these are part of the output)
     """
-    # remember the uuids which hold the file
-    files = collections.defaultdict(list)
-    # remember the uuid to description association
-    repositories = {}
-    for line in raw.decode("utf-8").split('\n'):
+    cmd = ["git-annex", "whereis", "--json"]
+    # a file keeps the error messages without blocking the command
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, cwd=path)
+        has_output = False
+        try:
+            for line in process.stdout:
+                has_output = has_output or bool(line.strip())
+                yield line
+        finally:
+            # the consumer may stop early
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0 and not has_output:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr.read())
+
+
+def iterate_annex_whereis(lines, repositories, omit_untrusted=False, with_keys=False):
+    """
+    parse 'git annex whereis --json' output line by line,
+    yields (filename, list of uuids) and fills the dictionary
+    repositories with the uuid -> description association,
+    with_keys: yield (filename, list of uuids, key)
+    """
+    for line in lines:
         # skip empty lines
-        if not line:
+        if not line.strip():
             continue
         # load json
-        j = json.loads(line)
+        j = json.loads(line.decode("utf-8") if isinstance(line, bytes) else line)
         # get file path
         filepath = j["file"]
         # we trust whereis, but we do not trust untrusted
@@ -51,6 +83,7 @@ def parse_annex_whereis(raw, omit_untrusted=False):
             for d in j["untrusted"]:
                 whereis.append((d, False))
 
+        uuids = []
         for whereis_dictionary, trusted in whereis:
             # create decent short cuts
             description, uuid = whereis_dictionary["description"], whereis_dictionary["uuid"]
@@ -58,11 +91,34 @@ def parse_annex_whereis(raw, omit_untrusted=False):
             if not trusted:
                 description += " [untrusted]"
             # this uuid has the file
-            files[filepath].append(uuid)
+            uuids.append(uuid)
             # remember uuid -> description
             if uuid not in repositories:
                 repositories[uuid] = description
 
+        if with_keys:
+            yield filepath, uuids, j.get("key")
+        else:
+            yield filepath, uuids
+
+
+def parse_annex_whereis(raw, omit_untrusted=False):
+    """
+    parse 'git annex whereis --json' output (the raw output or an iterable of lines),
+    returns a dictionary with the filename -> frozenset of uuids association
+    and a dictionary with the uuids > description association
+    """
+    if isinstance(raw, bytes):
+        raw = raw.split(b'\n')
+
+    # remember the uuids which hold the file, equal sets are shared
+    files = {}
+    location_sets = LocationSets()
+    # remember the uuid to description association
+    repositories = {}
+    for filepath, uuids in iterate_annex_whereis(raw, repositories, omit_untrusted):
+        files[filepath] = location_sets.uuids(location_sets.intern(uuids))
+
     # return parsed data
     return files, repositories
 
@@ -80,12 +136,96 @@ def group_files(files):
     return grouped
 
 
+class LocationSets:
+    """
+        interns the uuids to bits and the sets of uuids holding a file
+        to bitmasks, every distinct bitmask gets a small integer id
+    """
+
+    def __init__(self):
+        # uuid -> bit and bit -> uuid
+        self._bits = {}
+        self._uuids = []
+        # bitmask -> id and id -> bitmask
+        self._ids = {}
+        self._masks = []
+        # id -> frozenset of uuids, created on demand
+        self._uuid_sets = []
+        # short cut: tuple of uuids (as reported by git-annex) -> id
+        self._tuple_ids = {}
+
+    def __len__(self):
+        return len(self._masks)
+
+    def bit(self, uuid):
+        """ returns the bit of the uuid """
+        bit = self._bits.get(uuid)
+        if bit is None:
+            bit = self._bits[uuid] = len(self._uuids)
+            self._uuids.append(uuid)
+        return bit
+
+    def intern(self, uuids):
+        """ returns the id of the set of uuids """
+        key = tuple(uuids)
+        location_id = self._tuple_ids.get(key)
+        if location_id is not None:
+            return location_id
+
+        mask = 0
+        for uuid in key:
+            mask |= 1 << self.bit(uuid)
+
+        location_id = self._ids.get(mask)
+        if location_id is None:
+            location_id = self._ids[mask] = len(self._masks)
+            self._masks.append(mask)
+            self._uuid_sets.append(None)
+        self._tuple_ids[key] = location_id
+        return location_id
+
+    def mask(self, location_id):
+        """ returns the bitmask of the location set """
+        return self._masks[location_id]
+
+    def uuids(self, location_id):
+        """ returns the location set as frozenset of uuids """
+        uuid_set = self._uuid_sets[location_id]
+        if uuid_set is None:
+            mask = self._masks[location_id]
+            uuid_set = frozenset(uuid for bit, uuid in enumerate(self._uuids) if mask >> bit & 1)
+            self._uuid_sets[location_id] = uuid_set
+        return uuid_set
+
+
 class Directory:
-    def __init__(self, name, parent=None):
+    # there is one instance per directory of the annex
+    __slots__ = ("name", "parent", "dirs", "location_sets", "names", "locations", "sizes",
+                 "_file_count", "_byte_count", "_unknown_count", "_location_set")
+
+    # location set of a directory whose files are held by different sets of repositories
+    MIXED = -1
+    # size of a file whose key does not tell its size (e.g. URL or WORM keys)
+    UNKNOWN_SIZE = 2 ** 64 - 1
+
+    def __init__(self, name, parent=None, location_sets=None):
         self.name = name
         self.parent = parent
-        self.dirs = []
-        self.grouped = collections.defaultdict(list)
+        # name -> sub directory
+        self.dirs = {}
+        # the location sets are shared by the whole tree
+        if location_sets is None:
+            location_sets = parent.location_sets if parent is not None else LocationSets()
+        self.location_sets = location_sets
+        # the files of the directory as columns: file name, location set id and size (UNKNOWN_SIZE if unknown)
+        self.names = []
+        self.locations = array.array("I")
+        self.sizes = array.array("Q")
+        # aggregates of the subtree, computed on demand by summarise
+        self._file_count = None
+        self._byte_count = None
+        self._unknown_count = None
+        self._location_set = None
 
     def get_name(self):
         if not self.parent:
@@ -98,84 +238,180 @@ class Directory:
         return os.path.join(parent, self.name)
 
     def get_directory(self, directory_name):
-        for sub_directory in self.dirs:
-            if sub_directory.name == directory_name:
-                return sub_directory
-        else:
-            sub_directory = Directory(directory_name, self)
-            self.dirs.append(sub_directory)
-            return sub_directory
+        sub_directory = self.dirs.get(directory_name)
+        if sub_directory is None:
+            sub_directory = self.dirs[directory_name] = Directory(directory_name, self)
+            self.invalidate()
+        return sub_directory
 
     def get_subfolder(self, subfolder):
         # subfolder is a list
-        if not subfolder:
-            return self
-
-        sub_directory = self.get_directory(subfolder[0])
-        return sub_directory.get_subfolder(subfolder[1:])
-
-    def get_description(self):
-        if not self.grouped and not self.dirs:
+        directory = self
+        for directory_name in subfolder:
+            directory = directory.get_directory(directory_name)
+        return directory
+
+    def add_file(self, uuids, filename, size=None):
+        """ add a file (given by its name or path) which is held by the uuids, size: None if unknown """
+        self.names.append(os.path.basename(filename))
+        self.locations.append(self.location_sets.intern(uuids))
+        self.sizes.append(self.UNKNOWN_SIZE if size is None else size)
+        self.invalidate()
+
+    def invalidate(self):
+        """ forget the aggregates of this directory and its parents """
+        directory = self
+        while directory is not None and directory._file_count is not None:
+            directory._file_count = directory._byte_count = directory._unknown_count = None
+            directory._location_set = None
+            directory = directory.parent
+
+    def summarise(self):
+        """
+            compute file counts, byte counts (and the number of files of unknown size)
+            and location sets of all directories bottom-up (once)
+        """
+        if self._file_count is not None:
+            return
+
+        # post order traversal without recursion
+        stack = [(self, False)]
+        while stack:
+            directory, children_done = stack.pop()
+            if directory._file_count is not None:
+                continue
+            if not children_done:
+                stack.append((directory, True))
+                stack.extend((sub_directory, False) for sub_directory in directory.dirs.values())
+                continue
+
+            file_count = len(directory.names)
+            unknown_count = directory.sizes.count(self.UNKNOWN_SIZE)
+            byte_count = sum(directory.sizes) - unknown_count * self.UNKNOWN_SIZE
+            location_ids = set(directory.locations)
+            for sub_directory in directory.dirs.values():
+                file_count += sub_directory._file_count
+                byte_count += sub_directory._byte_count
+                unknown_count += sub_directory._unknown_count
+                if sub_directory._location_set is not None:
+                    location_ids.add(sub_directory._location_set)
+
+            directory._file_count = file_count
+            directory._byte_count = byte_count
+            directory._unknown_count = unknown_count
+            # None: no files, MIXED: more than one location set
+            if not location_ids:
+                directory._location_set = None
+            elif len(location_ids) == 1:
+                directory._location_set = location_ids.pop()
+            else:
+                directory._location_set = self.MIXED
+
+    def get_location_id_description(self, with_sizes=False):
+        """
+            like get_description, but the location sets are given by their ids,
+            with_sizes: files are given as (file path, size in bytes or None if unknown)
+        """
+        self.summarise()
+
+        if self._location_set is None:
             return None  # can be anything
 
         description = collections.defaultdict(list)
 
-        # gather information
-        for uuids, filepaths in self.grouped.items():
-            description[uuids].extend(filepaths)
-        for sub_directory in self.dirs:
-            sub_description = sub_directory.get_description()
-            # could be None
-            if sub_description:
-                for uuids, sub_list in sub_description.items():
-                    description[uuids].extend(sub_list)
-
         # judge: if only one uuid occurs, replace all the individual files with self
-        if len(description) == 1:
-            uuid = description.popitem()[0]
-            description[uuid].append(self)
+        if self._location_set != self.MIXED:
+            description[self._location_set].append(self)
+            return description
+
+        # gather information, only mixed directories have to be descended into
+        stack = [self]
+        while stack:
+            directory = stack.pop()
+            if directory.names:
+                directory_name = directory.get_name()
+                for filename, location_id, size in zip(directory.names, directory.locations, directory.sizes):
+                    filepath = os.path.join(directory_name, filename)
+                    if with_sizes:
+                        description[location_id].append((filepath, None if size == self.UNKNOWN_SIZE else size))
+                    else:
+                        description[location_id].append(filepath)
+            for sub_directory in directory.dirs.values():
+                if sub_directory._location_set == self.MIXED:
+                    stack.append(sub_directory)
+                elif sub_directory._location_set is not None:
+                    description[sub_directory._location_set].append(sub_directory)
 
         return description
 
+    def get_description(self):
+        description = self.get_location_id_description()
+        if description is None:
+            return None
+        return {self.location_sets.uuids(location_id): mixed_list
+                for location_id, mixed_list in description.items()}
+
     def get_file_count(self):
-        return sum(len(filepaths) for filepaths in self.grouped.values()) \
-               + sum(sub_dir.get_file_count() for sub_dir in self.dirs)
+        self.summarise()
+        return self._file_count
+
+    def get_byte_count(self):
+        """ size of all files in the subtree (as far as it is known) """
+        self.summarise()
+        return self._byte_count
+
+    def get_unknown_count(self):
+        """ number of files of unknown size in the subtree """
+        self.summarise()
+        return self._unknown_count
+
+    def location_totals(self):
+        """
+            returns a dictionary: location set id -> [number of files, bytes, files of unknown size]
+            in the subtree
+        """
+        totals = collections.defaultdict(lambda: [0, 0, 0])
+        stack = [self]
+        while stack:
+            directory = stack.pop()
+            for location_id, size in zip(directory.locations, directory.sizes):
+                entry = totals[location_id]
+                entry[0] += 1
+                if size == self.UNKNOWN_SIZE:
+                    entry[2] += 1
+                else:
+                    entry[1] += size
+            stack.extend(directory.dirs.values())
+        return totals
 
 
 def full_split(filepath):
     """ returns the sub folder list and the file name """
-    # get file name
-    path, filename = os.path.split(filepath)
-    # special case empty path
-    if not path:
-        return [], filename
-    # prepare split_path
-    split_path = [path]
-
-    # we call split until there is nothing to split anymore
-    while True:
-        split = os.path.split(split_path[0])
-        if not split[0]:
-            break
-        # if the split was succesful, replace the first item in split_filepath
-        split_path[0:1] = split
-
-    return split_path, filename
+    # split once, empty components stem from repeated separators
+    split_path = filepath.split(os.path.sep)
+    filename = split_path.pop()
+    return [directory_name for directory_name in split_path if directory_name], filename
 
 
 def group_files_hierarchical(files):
     """
-        group the file -> uuid association and preserve folder structure
+        group the file -> uuid association (a dictionary or an iterable of
+        (filename, uuids) or (filename, uuids, key) tuples) and preserve
+        folder structure, the sizes of the files are taken from the keys
     """
 
     root = Directory("")
 
-    for filepath, uuids in files.items():
+    if isinstance(files, dict):
+        files = files.items()
+
+    for entry in files:
+        filepath, uuids = entry[0], entry[1]
         split_path, filename = full_split(filepath)
         # get containing sub folder
         subfolder = root.get_subfolder(split_path)
         # add file
-        subfolder.grouped[frozenset(uuids)].append(filepath)
+        subfolder.add_file(uuids, filename, location_index.key_size(entry[2]) if len(entry) > 2 else None)
 
     return root
 
@@ -221,27 +457,48 @@ def colored_format(text, index):
     )
 
 
+def format_size(size):
+    """ human readable size """
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if size < 1024 or unit == "TiB":
+            return ("%d %s" % (size, unit)) if unit == "B" else ("%.1f %s" % (size, unit))
+        size /= 1024
+
+
+def format_count(file_count, byte_count, unknown_count=0):
+    """ formats the number of files and their size (as far as it is known) """
+    text = "%d files" % file_count
+    if byte_count:
+        text += ", %s" % format_size(byte_count)
+    if unknown_count:
+        text += ", %d of unknown size" % unknown_count
+    return text
+
+
 # noinspection PyArgumentList
 def print_report(root, repositories, number_of_content_lines=5):
+    # number of files and bytes per location set
+    totals = root.location_totals()
+
     # sort uuids by size
-    description = sorted(root.get_description().items(),
-                         key=lambda kv: get_file_count_from_mixed_list(kv[1]),
-                         reverse=True)
+    description = [(root.location_sets.uuids(location_id), mixed_list) + tuple(totals[location_id])
+                   for location_id, mixed_list in (root.get_location_id_description() or {}).items()]
+    description.sort(key=lambda entry: entry[2], reverse=True)
 
     # sort by occurences
-    flattened_list = sum((list(uuids) for uuids, _ in description), [])
+    flattened_list = [uuid for uuids, _, _, _, _ in description for uuid in uuids]
     counter_dict = collections.Counter(flattened_list)
     sorted_repos = sorted(repositories.items(),
                           key=lambda kv: (-counter_dict[kv[0]], kv[1]))
 
-    for uuids, mixed_directory_file_list in description:
+    for uuids, mixed_directory_file_list, file_count, byte_count, unknown_count in description:
         # print header
         repo_names = [colored_format(name, i)
                       for i, (uuid, name) in enumerate(sorted_repos)
                       if uuid in uuids]
         repo_names = ", ".join(repo_names)
-        file_count = get_file_count_from_mixed_list(mixed_directory_file_list)
-        print("repositories {repos} ({count} files)".format(repos=repo_names, count=file_count))
+        print("repositories {repos} ({count})".format(repos=repo_names, count=format_count(file_count, byte_count,
+                                                                                                 unknown_count)))
 
         # split it up
         directories = [element for element in mixed_directory_file_list if isinstance(element, Directory)]
@@ -265,9 +522,8 @@ def print_report(root, repositories, number_of_content_lines=5):
         while directories and elements_printed < number_of_content_lines:
             directory = directories.pop()
             folder_name = directory.get_name() + os.path.sep  # trailing sep
-            folder_count = directory.get_file_count()
-            file_count += folder_count
-            print("\t", folder_name, "(%d files)" % folder_count)
+            print("\t", folder_name, "(%s)" % format_count(directory.get_file_count(), directory.get_byte_count(),
+                                                           directory.get_unknown_count()))
             elements_printed += 1
 
         while files and elements_printed < number_of_content_lines:
@@ -282,7 +538,11 @@ def print_report(root, repositories, number_of_content_lines=5):
         if directories:
             directory_count = len(directories)
             file_count = sum(d.get_file_count() for d in directories)
-            comment = "{d_count} directories with {f_count} files".format(d_count=directory_count, f_count=file_count)
+            byte_count = sum(d.get_byte_count() for d in directories)
+            unknown_count = sum(d.get_unknown_count() for d in directories)
+            comment = "{d_count} directories with {count}".format(d_count=directory_count,
+                                                                   count=format_count(file_count, byte_count,
+                                                                                      unknown_count))
             omitted_comment.append(comment)
 
         if files:
@@ -296,12 +556,217 @@ def print_report(root, repositories, number_of_content_lines=5):
         print()
 
 
-def do_report(path, number_of_content_lines=5, omit_untrusted=False):
-    raw = annex_whereis(path)
-    files, repositories = parse_annex_whereis(raw, omit_untrusted=omit_untrusted)
-    # grouped = group_files(files)
-    root = group_files_hierarchical(files)
-    print_report(root, repositories, number_of_content_lines)
+# columns of the machine readable report
+REPORT_FIELDS = ("annex", "type", "path", "files", "bytes", "unknown_size_files", "uuids", "repositories")
+
+
+def report_records(root, repositories, annex=None):
+    """
+        yields the complete report (without truncation) as dictionaries with the keys
+        REPORT_FIELDS: one record of type 'location_set' per location set followed by
+        the directories (all files below them are held by the same location set, the
+        rollup) and the single files which make up the location set, bytes only counts the
+        files of known size (None for a single file of unknown size), annex is the name of
+        the reported annex (None for combined reports, there the path starts with the annex)
+    """
+    description = root.get_location_id_description(with_sizes=True)
+    if description is None:
+        return
+
+    # number of files and bytes per location set
+    totals = root.location_totals()
+
+    # sort location sets by size (and then by their uuids)
+    entries = [(sorted(root.location_sets.uuids(location_id)), mixed_list) + tuple(totals[location_id])
+               for location_id, mixed_list in description.items()]
+    entries.sort(key=lambda entry: (-entry[2], entry[0]))
+
+    for uuids, mixed_list, file_count, byte_count, unknown_count in entries:
+        names = [repositories.get(uuid, uuid) for uuid in uuids]
+
+        def record(record_type, path, files, byte_count, unknown_count):
+            return {"annex": annex, "type": record_type, "path": path, "files": files, "bytes": byte_count,
+                    "unknown_size_files": unknown_count, "uuids": uuids, "repositories": names}
+
+        yield record("location_set", None, file_count, byte_count, unknown_count)
+
+        # big folders first, then the files
+        directories = [element for element in mixed_list if isinstance(element, Directory)]
+        directories.sort(key=lambda d: (-d.get_file_count(), d.get_name()))
+        for directory in directories:
+            yield record("directory", (directory.get_name() or ".") + os.path.sep, directory.get_file_count(),
+                         directory.get_byte_count(), directory.get_unknown_count())
+
+        files = [element for element in mixed_list if not isinstance(element, Directory)]
+        for filepath, size in sorted(files, key=lambda element: element[0]):
+            yield record("file", filepath, 1, size, int(size is None))
+
+
+def write_records(records, stream, output_format, header=True):
+    """
+        write the records to stream as JSON lines (jsonl) or as CSV (csv), one by one,
+        header: write the CSV header (off when appending to an earlier report)
+    """
+    if output_format == "jsonl":
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+    elif output_format == "csv":
+        writer = csv.writer(stream)
+        if header:
+            writer.writerow(REPORT_FIELDS)
+        for record in records:
+            # lists are joined with ';'
+            writer.writerow(["" if record[field] is None
+                             else ";".join(record[field]) if isinstance(record[field], list)
+                             else record[field] for field in REPORT_FIELDS])
+    else:
+        raise ValueError("unknown output format: %s" % output_format)
+
+
+def output_report(root, repositories, number_of_content_lines=5, output_format="text", annex=None, header=True):
+    """ print the report of the tree in the given format (text, jsonl or csv), see report_records and write_records """
+    if output_format == "text":
+        print_report(root, repositories, number_of_content_lines)
+    else:
+        write_records(report_records(root, repositories, annex), sys.stdout, output_format, header)
+
+
+def read_locations(path, repositories, omit_untrusted=False, source="whereis", with_keys=False):
+    """
+        yields (file path, list of uuids) of the annex at path and fills repositories, the
+        location data is either read via 'git annex whereis' (source: whereis) or directly
+        from the git-annex branch, using the location snapshot of the repository (source: branch),
+        with_keys: yield (file path, list of uuids, key)
+    """
+    if source == "whereis":
+        return iterate_annex_whereis(stream_annex_whereis(path), repositories, omit_untrusted=omit_untrusted,
+                                     with_keys=with_keys)
+    elif source == "branch":
+        return location_index.read_cached_locations(path, repositories, omit_untrusted=omit_untrusted,
+                                                    with_keys=with_keys)
+    else:
+        raise ValueError("unknown source of location data: %s" % source)
+
+
+def do_report(path, number_of_content_lines=5, omit_untrusted=False, source="whereis", output_format="text",
+              annex=None, header=True):
+    """ print the report of the annex at path, see read_locations and output_report """
+    # build the tree while reading the location data
+    repositories = {}
+    root = group_files_hierarchical(read_locations(path, repositories, omit_untrusted, source, with_keys=True))
+    output_report(root, repositories, number_of_content_lines, output_format, annex, header)
+
+
+def group_annexes(annexes, repositories, omit_untrusted=False, source="whereis", jobs=1):
+    """
+        read the location data of several annexes, given as list of (annex name, path),
+        concurrently and group it into one tree, the files of every annex are placed
+        below a directory named after the annex (and the path, if several repositories
+        of the same annex are given), fills repositories
+    """
+    root = Directory("")
+
+    # every repository gets its own directory
+    names = collections.Counter(name for name, _ in annexes)
+    annexes = [(name if names[name] == 1 else "%s (%s)" % (name, path), path) for name, path in annexes]
+    subtrees = {}
+    for name, path in annexes:
+        assert name not in subtrees, "repository %s is given twice" % path
+        subtrees[name] = root.get_directory(name)
+
+    # the readers pass their files to this thread, which builds the tree
+    files = queue.Queue(maxsize=10000)
+    done = object()
+
+    def reader(annex):
+        name, path = annex
+        try:
+            annex_repositories = {}
+            for filepath, uuids, key in read_locations(path, annex_repositories, omit_untrusted, source,
+                                                       with_keys=True):
+                files.put((name, filepath, uuids, location_index.key_size(key)))
+            files.put((done, annex_repositories, None, None))
+        except Exception as e:
+            files.put((done, None, e, None))
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for annex in annexes:
+            executor.submit(reader, annex)
+
+        running = len(annexes)
+        while running:
+            name, filepath, uuids, size = files.get()
+            if name is done:
+                running -= 1
+                if uuids is not None:
+                    errors.append(uuids)
+                else:
+                    for uuid, description in filepath.items():
+                        repositories.setdefault(uuid, description)
+                continue
+            split_path, filename = full_split(filepath)
+            subtrees[name].get_subfolder(split_path).add_file(uuids, filename, size)
+
+    if errors:
+        raise errors[0]
+
+    return root
+
+
+def summarise_annexes(root, repositories):
+    """
+        machine readable summary of a tree built by group_annexes: the number of
+        files, bytes and files of unknown size per location set, in total and per annex
+    """
+    location_sets = root.location_sets
+
+    def describe(totals):
+        entries = []
+        for location_id, (file_count, byte_count, unknown_count) in sorted(totals.items(), key=lambda kv: -kv[1][0]):
+            uuids = sorted(location_sets.uuids(location_id))
+            entries.append({"uuids": uuids,
+                            "repositories": [repositories.get(uuid, uuid) for uuid in uuids],
+                            "files": file_count,
+                            "bytes": byte_count,
+                            "unknown_size_files": unknown_count})
+        return entries
+
+    total = collections.defaultdict(lambda: [0, 0, 0])
+    annexes = {}
+    for name, subtree in sorted(root.dirs.items()):
+        totals = subtree.location_totals()
+        for location_id, counts in totals.items():
+            for i, count in enumerate(counts):
+                total[location_id][i] += count
+        annexes[name] = {"files": subtree.get_file_count(), "bytes": subtree.get_byte_count(),
+                         "unknown_size_files": subtree.get_unknown_count(), "location_sets": describe(totals)}
+
+    return {"files": root.get_file_count(), "bytes": root.get_byte_count(),
+            "unknown_size_files": root.get_unknown_count(), "location_sets": describe(total), "annexes": annexes}
+
+
+def do_combined_report(annexes, number_of_content_lines=5, omit_untrusted=False, source="whereis", jobs=1,
+                       summary_path=None, output_format="text"):
+    """
+        print one report for several annexes, given as list of (annex name, path), and
+        write the machine readable summary as JSON to summary_path ('-' for stdout, only
+        with the text format as it would be mixed with the records)
+    """
+    if summary_path == "-" and output_format != "text":
+        raise ValueError("the summary cannot be printed along with the %s records" % output_format)
+
+    repositories = {}
+    root = group_annexes(annexes, repositories, omit_untrusted, source, jobs)
+    output_report(root, repositories, number_of_content_lines, output_format)
+
+    if summary_path is not None:
+        raw_json = json.dumps(summarise_annexes(root, repositories), ensure_ascii=False, indent=4, sort_keys=True)
+        if summary_path == "-":
+            print(raw_json)
+        else:
+            with io.open(summary_path, mode="wt", encoding="UTF8") as fd:
+                fd.write(raw_json)
 
 
 def application_main():
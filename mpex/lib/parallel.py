@@ -0,0 +1,170 @@
+import concurrent.futures
+import io
+import os
+import subprocess
+import sys
+import threading
+
+
+class ThreadOutput:
+    """
+        replacement for sys.stdout: threads which started a buffer write
+        into their own buffer, all other threads write to the original stream
+    """
+
+    def __init__(self, stream):
+        # save options
+        self.stream = stream
+        # per thread storage of the buffers
+        self._local = threading.local()
+        # serialises writes to the original stream
+        self._lock = threading.Lock()
+
+    def start_buffer(self):
+        """ redirect the output of the current thread into a new buffer """
+        self._local.buffer = io.StringIO()
+
+    def stop_buffer(self):
+        """ stop redirecting the output of the current thread, returns the buffered output """
+        buffer = self._local.buffer
+        self._local.buffer = None
+        return buffer.getvalue()
+
+    def is_buffering(self):
+        """ is the output of the current thread buffered? """
+        return getattr(self._local, "buffer", None) is not None
+
+    def write_through(self, s):
+        """ write s to the original stream (in one piece) """
+        with self._lock:
+            self.stream.write(s)
+            self.stream.flush()
+
+    def write(self, s):
+        if self.is_buffering():
+            return self._local.buffer.write(s)
+        with self._lock:
+            return self.stream.write(s)
+
+    def flush(self):
+        if not self.is_buffering():
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        # everything else is answered by the original stream
+        return getattr(self.stream, name)
+
+
+def is_buffering():
+    """ is the output of the current thread buffered? """
+    return isinstance(sys.stdout, ThreadOutput) and sys.stdout.is_buffering()
+
+
+def check_call(cmd, stdout=None, **kwargs):
+    """
+        see subprocess.check_call, if the output of the current thread
+        is buffered, the output of the command is captured into the buffer
+    """
+    # if nothing is buffered, the command can write directly to the terminal
+    if not is_buffering():
+        return subprocess.check_call(cmd, stdout=stdout, **kwargs)
+
+    if stdout is None:
+        # capture stdout and stderr together
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+        output, _ = process.communicate()
+    else:
+        # stdout is redirected elsewhere, only capture stderr
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=subprocess.PIPE, **kwargs)
+        _, output = process.communicate()
+
+    # forward the output to the buffer
+    sys.stdout.write(output.decode("UTF-8", errors="replace"))
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return 0
+
+
+# serialises the lines printed by call_prefixed
+_print_lock = threading.Lock()
+
+
+def call_prefixed(cmd, prefix, quiet=False, **kwargs):
+    """
+        run the command and stream its output line by line to sys.stdout,
+        every line is prefixed with prefix, if quiet is set only stderr
+        is shown, returns the exit status of the command
+    """
+    with open(os.devnull, "r+") as devnull:
+        if quiet:
+            process = subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=subprocess.PIPE, **kwargs)
+            stream = process.stderr
+        else:
+            process = subprocess.Popen(cmd, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+            stream = process.stdout
+
+        # forward the output line by line
+        with stream:
+            for line in stream:
+                line = line.decode("UTF-8", errors="replace").rstrip("\r\n")
+                with _print_lock:
+                    print(prefix + line)
+                    sys.stdout.flush()
+
+        return process.wait()
+
+
+def run_parallel(items, f, jobs):
+    """
+        apply f to all items using up to jobs worker threads, the output
+        of each call is buffered and printed in one piece once the call
+        has finished, returns the list of (item, exception) of failed calls
+    """
+    # nested calls share the installed output multiplexer
+    installed = isinstance(sys.stdout, ThreadOutput)
+    output = sys.stdout if installed else ThreadOutput(sys.stdout)
+
+    # if the calling thread is buffered itself, its buffer has to receive the output
+    nested = output.is_buffering()
+
+    def worker(item):
+        # redirect the output of this thread
+        output.start_buffer()
+        try:
+            f(item)
+            exception = None
+        except Exception as e:
+            exception = e
+        finally:
+            text = output.stop_buffer()
+        # print the output of this item in one piece
+        if not nested:
+            output.write_through(text)
+        return exception, text
+
+    failures = []
+
+    # install the output multiplexer
+    if not installed:
+        sys.stdout = output
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [(item, executor.submit(worker, item)) for item in items]
+            try:
+                for item, future in futures:
+                    exception, text = future.result()
+                    if nested:
+                        output.write(text)
+                    if exception is not None:
+                        failures.append((item, exception))
+            except KeyboardInterrupt:
+                # do not start any new work
+                for _, future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if not installed:
+            sys.stdout = output.stream
+
+    return failures
@@ -0,0 +1,124 @@
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# messages of ssh which mean that the server could not be reached, unlike e.g. a failed authentication
+UNREACHABLE_MESSAGES = ("Connection timed out", "Operation timed out", "Connection refused", "No route to host",
+                        "Network is unreachable", "Could not resolve hostname")
+
+
+class SSHPool:
+    """
+        manages one multiplexed ssh master connection per server: all later
+        ssh sessions (ssh, git and git-annex) to the server are routed through
+        it. the masters live as long as the process and are torn down at exit
+    """
+
+    def __init__(self, enabled=True):
+        # save options
+        self.enabled = enabled
+        # the directory holding the control sockets, created on first use
+        self._directory = None
+        # server -> master process
+        self._masters = {}
+        # server -> file holding the error messages of the master
+        self._errors = {}
+        # servers whose master failed because they could not be reached at all
+        self._unreachable = set()
+        self._lock = threading.Lock()
+
+    def _control_path(self):
+        """ returns the control path pattern, creates the socket directory if needed """
+        with self._lock:
+            if self._directory is None:
+                # keep the path short, unix sockets have a length limit
+                self._directory = tempfile.mkdtemp(prefix="mpex-ssh-")
+                atexit.register(self.close)
+            return os.path.join(self._directory, "%r@%h:%p")
+
+    def options(self):
+        """
+            ssh options which route the session through the master connection (if it exists),
+            without a master, ssh connects directly
+        """
+        if not self.enabled:
+            return []
+        return ["-o", "ControlPath=%s" % self._control_path()]
+
+    def environment(self):
+        """ environment for git and git-annex, so that their ssh sessions use the pool (or None) """
+        # respect the choice of the user
+        if not self.enabled or "GIT_SSH_COMMAND" in os.environ or "GIT_SSH" in os.environ:
+            return None
+
+        env = dict(os.environ)
+        env["GIT_SSH_COMMAND"] = " ".join(["ssh"] + ["'%s'" % option for option in self.options()])
+        return env
+
+    def start(self, server, options=()):
+        """
+            starts the master connection to server (if it is not yet running),
+            options are additional ssh options, returns True if the master is up
+        """
+        if not self.enabled:
+            return False
+
+        control_path = self._control_path()
+
+        with self._lock:
+            process = self._masters.get(server)
+            if process is None:
+                # the master runs in the foreground as our child, so it does not hold on to any of our pipes,
+                # its error messages go to a file, they tell why the master failed
+                cmd = ["ssh", "-M", "-N", "-o", "ControlPersist=no", "-o", "ControlPath=%s" % control_path] \
+                      + list(options) + [server]
+                errors = tempfile.TemporaryFile()
+                with open(os.devnull, "r+") as devnull:
+                    process = subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=errors)
+                self._masters[server] = process
+                self._errors[server] = errors
+
+        # wait until the master accepts sessions or gives up
+        check_cmd = ["ssh", "-o", "ControlPath=%s" % control_path, "-O", "check", server]
+        with open(os.devnull, "w") as devnull:
+            while process.poll() is None:
+                if subprocess.call(check_cmd, stdout=devnull, stderr=devnull) == 0:
+                    return True
+                time.sleep(0.1)
+
+        # remember if the server could not be reached at all
+        with self._lock:
+            errors = self._errors.pop(server, None)
+            if errors is not None:
+                errors.seek(0)
+                message = errors.read().decode(errors="replace")
+                errors.close()
+                if any(reason in message for reason in UNREACHABLE_MESSAGES):
+                    self._unreachable.add(server)
+        return False
+
+    def unreachable(self, server):
+        """ True if the master to server failed because the server could not be reached (e.g. it is offline) """
+        return server in self._unreachable
+
+    def close(self):
+        """ stops all master connections """
+        with self._lock:
+            directory, self._directory = self._directory, None
+            masters, self._masters = self._masters, {}
+            errors, self._errors = self._errors, {}
+
+        for stream in errors.values():
+            stream.close()
+
+        for process in masters.values():
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -1,13 +1,31 @@
 import collections
 import datetime
+import hashlib
 import json
 import os
 import subprocess
 
+from .lib import parallel
 from .lib.terminal import print_blue, print_red
 
+from . import grouped_repositories
+from . import location_index
+from . import transfer_planner
+
 
 class GitRepository:
+    # commands which are known to leave .git/config untouched,
+    # all other commands invalidate the cached config
+    CONFIG_PRESERVING_COMMANDS = (
+        ("git", "-c", "core.bare=false", "commit"),
+        ("git-annex", "add"),
+        ("git-annex", "describe"),
+        ("git-annex", "merge"),
+        ("git-annex", "semitrust"),
+        ("git-annex", "trust"),
+        ("git-annex", "untrust"),
+    )
+
     @property
     def local_path(self):
         raise NotImplementedError
@@ -15,15 +33,47 @@ class GitRepository:
     #
     # file system interaction
     #
-    def execute_command(self, cmd, ignore_exception=False, print_ignored_exception=True):
-        """ print and execute the command """
+    def execute_command(self, cmd, ignore_exception=False, print_ignored_exception=True, display_cmd=None):
+        """ print and execute the command in the repository """
 
-        # use the method given by the application
-        self.app.execute_command(cmd, ignore_exception=ignore_exception,
-                                 print_ignored_exception=print_ignored_exception)
-
-    def change_path(self, create=False):
-        """ change the path to the current repository """
+        try:
+            # use the method given by the application
+            self.app.execute_command(cmd, ignore_exception=ignore_exception,
+                                     print_ignored_exception=print_ignored_exception,
+                                     cwd=os.path.normpath(self.local_path), display_cmd=display_cmd)
+        finally:
+            # the command may have changed the repository
+            self.invalidate_caches(cmd)
+
+    def invalidate_caches(self, cmd):
+        """ forget all cached data which may be changed by the command """
+        if not any(tuple(cmd[:len(prefix)]) == prefix for prefix in self.CONFIG_PRESERVING_COMMANDS):
+            self._git_config_cache = None
+
+        # every command may change branches, remotes or the git-annex branch
+        self._metadata_cache = None
+
+    def cached_metadata(self, name, compute):
+        """ returns the cached metadata entry name, compute() is called if it is not yet known """
+        if getattr(self, "_metadata_cache", None) is None:
+            self._metadata_cache = {}
+
+        if name not in self._metadata_cache:
+            self._metadata_cache[name] = compute()
+
+        return self._metadata_cache[name]
+
+    def forget_metadata(self, name):
+        """ forget the cached metadata entry name """
+        if getattr(self, "_metadata_cache", None) is not None:
+            self._metadata_cache.pop(name, None)
+
+    def repository_path(self, create=False):
+        """
+            returns the normalised path to the current repository, the process'
+            working directory is not changed, instead the path is passed to
+            the commands which are run in the repository
+        """
 
         # get path
         path = os.path.normpath(self.local_path)
@@ -37,6 +87,17 @@ class GitRepository:
             print_red("%s is not a git annex repository, please run 'mpex init' first." % path, sep='')
             raise self.app.InterruptedException("this is not a git annex repository")
 
+        return path
+
+    def change_path(self, create=False):
+        """
+            change the path to the current repository, note that this changes
+            the working directory of the whole process
+        """
+
+        # get path
+        path = self.repository_path(create=create)
+
         # change to it
         os.chdir(path)
 
@@ -45,44 +106,79 @@ class GitRepository:
 
         return path
 
+    def git_config_snapshot(self):
+        """ reads the whole git config at once, returns a dictionary: key -> value """
+        # if there is a cache, use it
+        if getattr(self, "_git_config_cache", None) is not None:
+            return self._git_config_cache
+
+        # get path
+        path = self.repository_path()
+
+        # get output of 'git config --list --null', format: key\nvalue\0key\nvalue\0...
+        output = subprocess.check_output(["git", "config", "--list", "--null"], cwd=path).decode("UTF-8")
+
+        config = {}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            # keys without a value are possible
+            key, _, value = entry.partition("\n")
+            # later entries take precedence (like 'git config $key')
+            config[key] = value
+
+        # cache it
+        self._git_config_cache = config
+
+        return config
+
+    @staticmethod
+    def normalise_config_key(key):
+        """ git reports section and variable names in lower case, the subsection is case sensitive """
+        section, _, rest = key.partition(".")
+        subsection, _, name = rest.rpartition(".")
+        if subsection:
+            return "%s.%s.%s" % (section.lower(), subsection, name.lower())
+        else:
+            return "%s.%s" % (section.lower(), name.lower())
+
     def git_config(self, key, default=None):
         """ read a git key """
-        # change path
-        self.change_path()
-
-        try:
-            # get output of 'git config $key' and return it
-            output = subprocess.check_output(["git", "config", key]).decode("UTF-8").strip()
-            assert output, "Error."
-            return output
-        except subprocess.CalledProcessError:
-            return default
+        # look up the key in the config snapshot
+        value = self.git_config_snapshot().get(self.normalise_config_key(key))
+        return value.strip() if value and value.strip() else default
 
     def git_branch(self):
         """ returns all known branches """
-        # change path
-        self.change_path()
+        def read_branches():
+            # get path
+            path = self.repository_path()
 
-        # call 'git branch'
-        output = subprocess.check_output(["git", "branch"]).decode("UTF8")
-        # the first two characters are noise
-        return [line[2:].strip() for line in output.splitlines() if line.strip()]
+            # call 'git branch'
+            output = subprocess.check_output(["git", "branch"], cwd=path).decode("UTF8")
+            # the first two characters are noise
+            return [line[2:].strip() for line in output.splitlines() if line.strip()]
 
-    @staticmethod
-    def git_head():
+        # return a copy of the cached list
+        return list(self.cached_metadata("branches", read_branches))
+
+    def git_head(self):
         """ get the git HEAD of the master branch """
-        return subprocess.check_output(["git", "rev-parse", "HEAD"]).strip()
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=self.repository_path()).strip()
 
     def git_remotes(self):
         """ find all git remotes """
+        def read_remotes():
+            # get path
+            path = self.repository_path()
 
-        # change into the right directory
-        self.change_path()
+            # read all remotes
+            cmd = ["git", "remote", "show"]
+            output = subprocess.check_output(cmd, cwd=path).decode("UTF-8")
+            return {remote.strip() for remote in output.splitlines()}
 
-        # read all remotes
-        cmd = ["git", "remote", "show"]
-        output = subprocess.check_output(cmd).decode("UTF-8")
-        return {remote.strip() for remote in output.splitlines()}
+        # return a copy of the cached set
+        return set(self.cached_metadata("remotes", read_remotes))
 
 
 class GitAnnexRepository(GitRepository):
@@ -90,34 +186,35 @@ class GitAnnexRepository(GitRepository):
         raise NotImplementedError
 
     def git_annex_info(self):
-        """ calls 'git-annex info --fast --json' and parses the output """
-        # change path
-        self.change_path()
+        """ calls 'git-annex info --fast --json' and parses the output (cached until the next command) """
+        def read_info():
+            # get path
+            path = self.repository_path()
 
-        # call the command
-        cmd = ["git-annex", "info", "--fast", "--json"]
-        with open(os.devnull, "w") as devnull:
-            output = subprocess.check_output(cmd, stderr=devnull).decode("UTF-8")
+            # call the command
+            cmd = ["git-annex", "info", "--fast", "--json"]
+            with open(os.devnull, "w") as devnull:
+                output = subprocess.check_output(cmd, stderr=devnull, cwd=path).decode("UTF-8")
 
-        # parse output
-        info = json.loads(output)
+            # parse output
+            return json.loads(output)
 
-        return info
+        return self.cached_metadata("info", read_info)
 
     def get_annex_UUID(self):
         """ get the git annex uuid of the current repository """
-        return self.git_config("annex.uuid")
+        return self.cached_metadata("uuid", lambda: self.git_config("annex.uuid"))
 
     def git_annex_status(self):
         """ call 'git annex status' """
-        # change into the right directory
-        self.change_path()
+        # get path
+        path = self.repository_path()
 
         # get status
         cmd = ["git", "annex", "status", "--json"]
 
         # call command
-        output = subprocess.check_output(cmd).decode("UTF-8")
+        output = subprocess.check_output(cmd, cwd=path).decode("UTF-8")
         data = [json.loads(s) for s in output.split("\n") if s]
         print(data)
         # data looks like: list of {"status":"<status>","file":"<name>"}
@@ -241,8 +338,8 @@ class GitAnnexRepository(GitRepository):
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
             print_blue("initialise", self.annex.name, "at", self.local_path)
 
-        # change into the right directory, create it if necessary
-        self.change_path(create=True)
+        # check the path to the repository, create it if necessary
+        self.repository_path(create=True)
 
         # init git
         if not os.path.isdir(os.path.join(self.local_path, ".git")):
@@ -271,8 +368,8 @@ class GitAnnexRepository(GitRepository):
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
             print_blue("setting properties of", self.annex.name, "at", self.local_path)
 
-        # change into the right directory
-        self.change_path()
+        # check the path to the repository
+        self.repository_path()
 
         # make sure that the master branch exists
         self.repair_master()
@@ -335,14 +432,54 @@ class GitAnnexRepository(GitRepository):
                 # if everything is alright
                 continue
 
+    def working_tree_status(self):
+        """
+            returns the output of 'git status --porcelain' (empty if there is nothing
+            to commit), or None if the status cannot be determined (direct mode)
+        """
+        # in direct mode, git cannot tell us anything about the working tree
+        if self.on_disk_direct_mode() == "direct":
+            return None
+
+        # get path
+        path = self.repository_path()
+
+        cmd = ["git", "status", "--porcelain", "-z", "--untracked-files=all"]
+        return subprocess.check_output(cmd, cwd=path)
+
+    def sync_state(self):
+        """
+            fingerprint of everything a sync would act on: all refs (including the
+            git-annex branch) and the working tree, None if it cannot be determined
+        """
+        # get the working tree status
+        status = self.working_tree_status()
+        if status is None:
+            return None
+
+        # get path
+        path = self.repository_path()
+
+        # 'git show-ref' fails if there are no refs at all
+        process = subprocess.Popen(["git", "show-ref"], stdout=subprocess.PIPE, cwd=path)
+        refs, _ = process.communicate()
+
+        return hashlib.sha256(refs + b"\0\0" + status).hexdigest()
+
     def finalise(self):
         """ calls git-annex add and commits all changes """
 
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
             print_blue("commiting changes in", self.annex.name, "at", self.local_path)
 
-        # change into the right directory
-        self.change_path()
+        # check the path to the repository
+        self.repository_path()
+
+        # skip it, if there is nothing to commit
+        if self.working_tree_status() == b"":
+            if self.app.verbose <= self.app.VERBOSE_NORMAL:
+                print("nothing to commit")
+            return
 
         # call 'git-annex add'
         self.execute_command(["git-annex", "add"])
@@ -359,8 +496,22 @@ class GitAnnexRepository(GitRepository):
     def sync(self, repositories=None):
         """
             calls finalise and git-annex sync, when repositories is given, sync
-            only with those, otherwise with all connected repositories insted
+            only with those, otherwise with all connected repositories insted,
+            the sync is skipped if nothing changed since the last sync with the
+            same repositories
         """
+        # states after the previous syncs: repositories -> state
+        if getattr(self, "_sync_states", None) is None:
+            self._sync_states = {}
+        key = None if repositories is None else frozenset(repositories)
+
+        # skip the sync, if nothing changed since the last sync
+        state = self.sync_state()
+        if state is not None and self._sync_states.get(key) == state:
+            if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
+                print_blue("skipping sync of", self.annex.name, "in", self.local_path, "(nothing changed)")
+            return
+
         # finalise repository
         self.finalise()
 
@@ -370,8 +521,8 @@ class GitAnnexRepository(GitRepository):
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
             print_blue("syncing", self.annex.name, "in", self.local_path)
 
-        # change into the right directory
-        self.change_path()
+        # check the path to the repository
+        self.repository_path()
 
         # repositories to sync with (select only non-special repositories)
         sync_repos = set(repo for repo in self.standard_repositories().keys() if not repo.is_special())
@@ -391,13 +542,22 @@ class GitAnnexRepository(GitRepository):
             # if no other annex is available, still do basic maintanence
             self.execute_command(["git-annex", "merge"])
 
+        # remember the state after the sync (simulated commands change nothing)
+        if not self.app.simulate:
+            self._sync_states[key] = self.sync_state()
+
     def repair_master(self):
         """ creates the master branch if necessary """
 
-        # change into the right directory
-        self.change_path()
+        # check the path to the repository
+        self.repository_path()
 
         branches = self.git_branch()
+        if "master" not in branches:
+            # the cache may be outdated, the branch may have been pushed by others
+            self.forget_metadata("branches")
+            branches = self.git_branch()
+
         # unneeded, if the master branch already exists
         if "master" in branches:
             return
@@ -406,7 +566,8 @@ class GitAnnexRepository(GitRepository):
         # (http://git-annex.branchable.com/direct_mode/)
         self.execute_command(["git", "-c", "core.bare=false", "commit", "--allow-empty", "-m", "empty commit"])
 
-    def copy(self, copy_all=False, repositories=None, files=None, strict=None):
+    def copy(self, copy_all=False, repositories=None, files=None, strict=None, plan=True, jobs=None,
+             estimate=False):
         """
             copy files, arguments:
             - copy_all: call git annex with the --all flag
@@ -415,16 +576,25 @@ class GitAnnexRepository(GitRepository):
                      defaults to the local repositories files entry, if nothing is given,
                      all files are transfered
             - strict: drop all files which do not match the local files expression
+            - plan: compute the needed transfers from the location data at once instead
+                    of calling git-annex for every repository (not possible with copy_all)
+            - jobs: number of parallel transfers per repository (limited by the jobs
+                    setting of the connection), different repositories are served
+                    concurrently if jobs is larger than one
+            - estimate: only print the bytes which would be transferred between every pair
+                        of repositories (dry run, needs the plan), nothing is synced or copied
         """
 
         # use files expression of the current repository, if none is given
         if files is None:
-            local_files_cmd = self.files_as_cmd()
+            local_files_tokens = self.tokenised_files()
         else:
-            local_files_cmd = self._files_as_cmd(files)
+            local_files_tokens = self._tokenise_files_expression(files)
+        local_files_cmd = self._tokenised_files_expression_to_cmd(local_files_tokens)
 
-        # repositories to copy from and to
-        repos = set(self.standard_repositories().keys())
+        # repositories to copy from and to (and the connections to them)
+        connections = self.standard_repositories()
+        repos = set(connections.keys())
 
         # check that all these repositories are registered
         self.missing_git_remotes_check(repos)
@@ -438,14 +608,195 @@ class GitAnnexRepository(GitRepository):
             # if we can convert it to command line arguments, then everything is fine
             _ = repo.files_as_cmd()
 
-        # sync
+        # sync (but do not touch anything in a dry run)
+        if not estimate:
+            self.sync(repos)
+
+        if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
+            print_blue("estimating transfers of" if estimate else "copying files of",
+                       self.annex.name, "at", self.local_path)
+
+        # check the path to the repository
+        self.repository_path()
+
+        # use strict of the current repository, if none is given
+        if strict is None:
+            strict = self.strict
+
+        # git-annex flags for parallel transfers with every repository
+        jobs_flags = {repo: self.annex_jobs_flags(connections[repo], jobs) for repo in repos}
+
+        # the planner only knows the files in the working tree
+        transfer_plan = self.plan_copy(repos, local_files_tokens, strict) if plan and not copy_all else None
+
+        if estimate:
+            if transfer_plan is None:
+                print_red("no estimate possible without a transfer plan")
+            else:
+                self.print_transfer_estimate(transfer_plan)
+            return
+
+        if transfer_plan is not None:
+            self.execute_transfer_plan(transfer_plan, jobs_flags, jobs)
+        else:
+            self.copy_per_remote(repos, local_files_cmd, strict, copy_all, jobs_flags, jobs)
+
+        # sync again
         self.sync(repos)
 
+    def annex_jobs_flags(self, connections, jobs):
+        """
+            returns the git-annex flags for parallel transfers over one of the
+            given connections (None stands for the local file system)
+        """
+        if jobs is None or jobs <= 1 or not self.app.git_annex_capabilities["jobs"]:
+            return []
+
+        # respect the limits of the connections, local transfers are not limited
+        limits = [connection.jobs for connection in connections
+                  if connection is not None and connection.jobs is not None]
+        if limits and None not in connections:
+            jobs = min([jobs] + limits)
+
+        return ["--jobs=%d" % jobs] if jobs > 1 else []
+
+    def execute_concurrently(self, commands, jobs):
+        """
+            executes commands, a list of (repository, list of (cmd, display_cmd)): the commands
+            of one repository run in order, if jobs is larger than one, up to jobs repositories
+            are served concurrently
+        """
+        def execute(item):
+            for cmd, display_cmd in item[1]:
+                self.execute_command(cmd, display_cmd=display_cmd)
+
+        # nothing to gain from threads
+        if jobs is None or jobs <= 1 or len(commands) <= 1:
+            for item in commands:
+                execute(item)
+            return
+
+        # serve the repositories concurrently
+        failures = parallel.run_parallel(commands, execute, min(jobs, len(commands)))
+        if failures:
+            for repo, e in failures:
+                print_red("transfers with %s failed:" % repo, str(e))
+            raise self.app.InterruptedException("%d transfers failed" % len(failures))
+
+    def annex_uuids(self):
+        """ returns a dictionary: description -> uuid for all repositories known to the annex """
+        # descriptions from the git-annex branch
+        descriptions = transfer_planner.read_uuid_descriptions(self.repository_path())
+        uuids = {description: uuid for uuid, description in descriptions.items()}
+
+        # the uuids git-annex recorded for the remotes are authoritative
+        for repo in self.annex.repositories():
+            uuid = self.git_config("remote.%s.annex-uuid" % repo.gitID())
+            if uuid:
+                uuids[repo.description] = uuid
+
+        # and so is our own uuid
+        uuids[self.description] = self.get_annex_UUID()
+
+        return uuids
+
+    def plan_copy(self, repos, local_files_tokens, strict):
+        """
+            computes the transfers and drops needed by copy from the output of one
+            'git-annex whereis' call, returns None if the plan cannot be computed
+        """
+        # build the matchers of all files expressions
+        uuids = self.annex_uuids()
+        local_matcher = transfer_planner.FilesExpressionMatcher(local_files_tokens, uuids)
+        remotes = []
+        for repo in sorted(repos, key=str):
+            matcher = transfer_planner.FilesExpressionMatcher(repo.tokenised_files(), uuids)
+            remotes.append((repo, uuids.get(repo.description), matcher, repo.strict))
+
+        # without the uuids of all involved repositories, we cannot decide anything
+        missing = local_matcher.missing_descriptions()
+        for repo, uuid, matcher, _ in remotes:
+            missing |= matcher.missing_descriptions()
+            if uuid is None:
+                missing.add(repo.description)
+        if missing:
+            if self.app.verbose <= self.app.VERBOSE_NORMAL:
+                print("unknown uuid of %s, copying per repository" % ", ".join(sorted(missing)))
+            return None
+
+        # load the location data (and the sizes from the keys) once
+        files, sizes = {}, {}
+        lines = grouped_repositories.stream_annex_whereis(self.repository_path())
+        try:
+            for filepath, locations, key in grouped_repositories.iterate_annex_whereis(lines, {}, with_keys=True):
+                files[filepath] = locations
+                sizes[filepath] = location_index.key_size(key)
+        except subprocess.CalledProcessError as e:
+            print_red("git-annex whereis failed, copying per repository:",
+                      (e.stderr or b"").decode("UTF-8", errors="replace").strip() or str(e))
+            return None
+
+        return transfer_planner.plan_transfers(files, self.get_annex_UUID(), local_matcher, remotes, strict, sizes)
+
+    def print_transfer_estimate(self, transfer_plan):
+        """ prints the number of files and bytes the plan moves between every pair of repositories """
+        def name(repo):
+            return self.description if repo is None else repo.description
+
+        estimate = transfer_plan.estimate()
+        if not estimate:
+            print("nothing to transfer")
+        for source, destination, files, size, unknown in sorted(estimate, key=lambda e: (name(e[0]), name(e[1]))):
+            text = "%s -> %s: %d files, %s" % (name(source), name(destination), files,
+                                               grouped_repositories.format_size(size))
+            if unknown:
+                text += " (%d files of unknown size)" % unknown
+            print(text)
+
+    def execute_transfer_plan(self, transfer_plan, jobs_flags, jobs=None):
+        """
+            executes the transfers and drops of the plan, jobs_flags maps
+            every repository to its git-annex flags for parallel transfers
+        """
+
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
-            print_blue("copying files of", self.annex.name, "at", self.local_path)
+            print("planned %d transfers and %d drops"
+                  % (transfer_plan.transfer_count(), transfer_plan.drop_count()))
+        if self.app.verbose <= self.app.VERBOSE_NORMAL:
+            self.print_transfer_estimate(transfer_plan)
+
+        def commands(cmd, files):
+            # split the files into chunks which fit on the command line
+            return [(cmd + chunk, cmd + ["<%d files>" % len(chunk)]) for chunk in transfer_planner.chunks(files)]
 
-        # change into the right directory
-        self.change_path()
+        # rationale: --fast: we are synced
+        flags = ["--fast"]
+
+        # pull first, then push
+        pulls, pushes = [], []
+        for (source, destination), files in sorted(transfer_plan.transfers.items(), key=lambda kv: str(kv[0])):
+            if destination is None:
+                # call 'git-annex copy --fast [--jobs=n] --from=target -- <files>'
+                cmd = ["git-annex", "copy"] + flags + jobs_flags[source] + ["--from=%s" % source.gitID(), "--"]
+                pulls.append((source, commands(cmd, files)))
+            else:
+                # call 'git-annex copy --fast [--jobs=n] --to=target -- <files>'
+                cmd = ["git-annex", "copy"] + flags + jobs_flags[destination] \
+                      + ["--to=%s" % destination.gitID(), "--"]
+                pushes.append((destination, commands(cmd, files)))
+        self.execute_concurrently(pulls, jobs)
+        self.execute_concurrently(pushes, jobs)
+
+        # apply strict, local repository first
+        drops = sorted(transfer_plan.drops.items(), key=lambda kv: (kv[0] is not None, str(kv[0])))
+        for repo, files in drops:
+            # call 'git-annex drop [--from=target] -- <files>'
+            drop_cmd = ["git-annex", "drop"] + (["--from=%s" % repo.gitID()] if repo is not None else []) + ["--"]
+            for cmd, display_cmd in commands(drop_cmd, files):
+                self.execute_command(cmd, display_cmd=display_cmd, ignore_exception=True)
+
+    def copy_per_remote(self, repos, local_files_cmd, strict, copy_all, jobs_flags, jobs=None):
+        """ calls git-annex copy and drop for every repository """
 
         #
         # pull
@@ -459,31 +810,31 @@ class GitAnnexRepository(GitRepository):
         if copy_all:
             flags.append("--all")
 
-        # call 'git-annex copy --fast [--all] --from=target <files expression as command>'
+        # call 'git-annex copy --fast [--all] [--jobs=n] --from=target <files expression as command>'
+        pulls = []
         for repo in sorted(repos, key=str):
-            cmd = ["git-annex", "copy"] + flags + ["--from=%s" % repo.gitID()] + local_files_cmd
-            self.execute_command(cmd)
+            cmd = ["git-annex", "copy"] + flags + jobs_flags[repo] + ["--from=%s" % repo.gitID()] + local_files_cmd
+            pulls.append((repo, [(cmd, None)]))
+        self.execute_concurrently(pulls, jobs)
 
         #
         # push
         #
 
+        pushes = []
         for repo in sorted(repos, key=str):
             # parse remote files expression
             files_cmd = repo.files_as_cmd()
 
-            # call 'git-annex copy --fast [--all] --to=target <files expression as command>'
-            cmd = ["git-annex", "copy"] + flags + ["--to=%s" % repo.gitID()] + files_cmd
-            self.execute_command(cmd)
+            # call 'git-annex copy --fast [--all] [--jobs=n] --to=target <files expression as command>'
+            cmd = ["git-annex", "copy"] + flags + jobs_flags[repo] + ["--to=%s" % repo.gitID()] + files_cmd
+            pushes.append((repo, [(cmd, None)]))
+        self.execute_concurrently(pushes, jobs)
 
         #
         # apply strict
         #
 
-        # use strict of the current repository, if none is given
-        if strict is None:
-            strict = self.strict
-
         if strict:
             # call 'git-annex drop --not -( <files expression -)
             cmd = ["git-annex", "drop"] + ["--not", "-("] + local_files_cmd + ["-)"]
@@ -501,9 +852,6 @@ class GitAnnexRepository(GitRepository):
             cmd = ["git-annex", "drop", "--from=%s" % repo.gitID()] + ["--not", "-("] + files_cmd + ["-)"]
             self.execute_command(cmd, ignore_exception=True)
 
-        # sync again
-        self.sync(repos)
-
     def delete_all_remotes(self):
         """
             deletes all remotes found in .git/config, this implicitly deletes
@@ -513,8 +861,8 @@ class GitAnnexRepository(GitRepository):
         if self.app.verbose <= self.app.VERBOSE_IMPORTANT:
             print_blue("delete all remotes of", self.annex.name, "in", self.local_path)
 
-        # change path to current directory
-        self.change_path()
+        # check the path to the repository
+        self.repository_path()
 
         # find all remotes
         remotes = self.git_remotes()
@@ -538,11 +886,12 @@ class LocalRepository(GitAnnexRepository):
             finalise()
             sync(annex descriptions=None)
             repair_master()
-            copy(annex descriptions, files expression, strict=true/false)
+            copy(annex descriptions, files expression, strict=true/false, plan=true/false)
             delete_all_remotes()
 
         git methods:
             git_config(key) -> value
+            git_config_snapshot() -> dictionary of all config values
             git_branch() -> list of branches
             git_head() -> git head
         
@@ -555,6 +904,7 @@ class LocalRepository(GitAnnexRepository):
             on_disk_description()
             
         other methods:
+            repository_path()
             change_path()
             standard_repositories()
     """
@@ -622,8 +972,9 @@ class LocalRepository(GitAnnexRepository):
     def standard_repositories(self):
         """ determine repositories which are online (from the point of view of the current host) """
         # convert connections to a dictionary dest -> set of connections to dest
+        host_connections = self.app.current_host().connections()
         connections = collections.defaultdict(set)
-        for connection in self.app.current_host().connections():
+        for connection in host_connections:
             connections[connection.dest].add(connection)
 
         # add trivial connection from the current host!
@@ -632,6 +983,10 @@ class LocalRepository(GitAnnexRepository):
         # get repositories
         repositories = self.annex.repositories()
 
+        # check all relevant connections at once
+        hosts = {repository.host for repository in repositories}
+        self.app.connections.probe(c for c in host_connections if c.dest in hosts)
+
         # get the repositories which are online
         active_repos = collections.defaultdict(set)
 
@@ -0,0 +1,417 @@
+import collections
+import io
+import json
+import os
+import subprocess
+import threading
+
+from . import transfer_planner
+
+# the branch git-annex stores its metadata in
+ANNEX_BRANCH = "refs/heads/git-annex"
+
+# pointer files of unlocked files are small, larger blobs are not inspected
+MAX_POINTER_SIZE = 1024
+
+# trust levels as written to trust.log
+TRUSTED, SEMITRUSTED, UNTRUSTED, DEAD = "1", "?", "0", "X"
+
+
+def cat_file_batch(path, requests, check=False):
+    """
+        resolves the objects with one 'git cat-file --batch' process, requests is an
+        iterable of (tag, object name), yields (tag, content or None if the object
+        does not exist) in the same order, the requests are written by a separate
+        thread, so both pipes keep flowing, if check is set, the size of the object
+        is returned instead of its content ('git cat-file --batch-check'), requests
+        with object name None are answered with None without asking git
+    """
+    mode = "--batch-check" if check else "--batch"
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(["git", "cat-file", mode], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=devnull, cwd=path)
+
+    # (tag, was it sent) of the requests which are not yet answered
+    pending = collections.deque()
+    errors = []
+
+    def writer():
+        try:
+            for tag, object_name in requests:
+                if object_name is None:
+                    pending.append((tag, False))
+                    continue
+                pending.append((tag, True))
+                process.stdin.write(object_name.encode("UTF-8") + b"\n")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            header = process.stdout.readline()
+            if not header:
+                break
+            # the requests which were not sent come first (they were queued before)
+            while not pending[0][1]:
+                yield pending.popleft()[0], None
+            tag, _ = pending.popleft()
+            if header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+                yield tag, None
+                continue
+            # header: <sha> <type> <size>
+            size = int(header.split()[2])
+            if check:
+                yield tag, size
+                continue
+            content = process.stdout.read(size)
+            # skip the trailing newline
+            process.stdout.read(1)
+            yield tag, content
+    finally:
+        # the consumer may stop early
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    # the requests after the last one which was sent
+    for tag, sent in pending:
+        assert not sent, "git cat-file did not answer all requests"
+        yield tag, None
+
+
+def ls_tree(path, treeish="HEAD"):
+    """ yields (mode, object, size, file path) of all files in the tree """
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(["git", "ls-tree", "-r", "-l", "-z", treeish],
+                                   stdout=subprocess.PIPE, stderr=devnull, cwd=path)
+    try:
+        rest = b""
+        for chunk in iter(lambda: process.stdout.read(65536), b""):
+            entries = (rest + chunk).split(b"\0")
+            rest = entries.pop()
+            for entry in entries:
+                # entry: <mode> <type> <object> <size>\t<path>
+                info, _, filepath = entry.partition(b"\t")
+                mode, _, obj, size = info.split()
+                yield mode.decode(), obj.decode(), size.decode(), filepath.decode("UTF-8", errors="surrogateescape")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+def key_from_blob(mode, content):
+    """ extracts the key from the content of a symlink or a pointer file (or None) """
+    if content is None:
+        return None
+    target = content.decode("UTF-8", errors="surrogateescape")
+    if mode != "120000":
+        # pointer files contain '/annex/objects/<key>' in their first line
+        target = target.split("\n", 1)[0]
+        if not target.startswith("/annex/objects/"):
+            return None
+    elif "annex/objects/" not in target:
+        # a symbolic link which is not managed by git-annex
+        return None
+    return target.rstrip("/").rsplit("/", 1)[-1]
+
+
+def location_logs(path):
+    """
+        returns a dictionary key -> object of its location log, the logs are
+        found by listing the git-annex branch once (looking up every log by
+        its path would make git parse the large fan out trees again and again)
+    """
+    logs = {}
+    for _, obj, _, filepath in ls_tree(path, ANNEX_BRANCH):
+        # location logs live in the hash directories: <hash>/<hash>/<key>.log
+        directory, _, filename = filepath.rpartition("/")
+        if directory and filename.endswith(".log"):
+            logs[filename[:-len(".log")]] = obj
+    return logs
+
+
+def parse_location_log(raw):
+    """
+        parse a location log, lines have the form '<timestamp>s <status> <uuid>',
+        the most recent line of every uuid decides, returns the uuids with status 1
+    """
+    state = {}
+    for line in raw.decode("UTF-8", errors="replace").splitlines():
+        parts = line.split()
+        if len(parts) != 3:
+            continue
+        timestamp, status, uuid = parts
+        try:
+            timestamp = float(timestamp.rstrip("s"))
+        except ValueError:
+            continue
+        if uuid not in state or timestamp >= state[uuid][0]:
+            state[uuid] = timestamp, status
+    return {uuid for uuid, (_, status) in state.items() if status == "1"}
+
+
+def parse_trust_log(raw):
+    """
+        parse trust.log, lines have the form '<uuid> <level> [timestamp=<time>s]',
+        returns a dictionary uuid -> trust level (the most recent level wins)
+    """
+    levels = {}
+    timestamps = {}
+    for line in raw.decode("UTF-8", errors="replace").splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        uuid, level = parts[0], parts[1]
+        timestamp = 0.0
+        if len(parts) > 2 and parts[2].startswith("timestamp="):
+            try:
+                timestamp = float(parts[2][len("timestamp="):].rstrip("s"))
+            except ValueError:
+                pass
+        if timestamp >= timestamps.get(uuid, timestamp):
+            levels[uuid], timestamps[uuid] = level, timestamp
+    return levels
+
+
+def read_branch_file(path, filename):
+    """ read a file of the git-annex branch, returns b"" if it does not exist """
+    process = subprocess.Popen(["git", "cat-file", "-p", "%s:%s" % (ANNEX_BRANCH, filename)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=path)
+    output, _ = process.communicate()
+    return output if process.returncode == 0 else b""
+
+
+def annexed_files(path, treeish="HEAD"):
+    """ yields (file path, key) of all annexed files in the tree """
+    # symbolic links and small files may point to annexed content
+    candidates = ((entry, entry[1]) for entry in ls_tree(path, treeish)
+                  if entry[0] == "120000" or (entry[2].isdigit() and int(entry[2]) <= MAX_POINTER_SIZE))
+
+    for (mode, _, _, filepath), content in cat_file_batch(path, candidates):
+        key = key_from_blob(mode, content)
+        if key is not None:
+            yield filepath, key
+
+
+def trust_filter(path, repositories, omit_untrusted=False):
+    """
+        returns a function which removes the uuids which should not be shown from a
+        list of uuids, it fills repositories with the uuid -> description association
+    """
+    descriptions = transfer_planner.parse_uuid_log(read_branch_file(path, "uuid.log"))
+    trust = parse_trust_log(read_branch_file(path, "trust.log"))
+
+    def f(uuids):
+        shown = []
+        for uuid in uuids:
+            level = trust.get(uuid, SEMITRUSTED)
+            # dead repositories are never shown
+            if level == DEAD or (level == UNTRUSTED and omit_untrusted):
+                continue
+            shown.append(uuid)
+            # remember uuid -> description, mark untrusthworthy repositories
+            if uuid not in repositories:
+                description = descriptions.get(uuid) or uuid
+                repositories[uuid] = description + " [untrusted]" if level == UNTRUSTED else description
+        return shown
+
+    return f
+
+
+def read_branch_locations(path, repositories, omit_untrusted=False, treeish="HEAD", with_keys=False):
+    """
+        like grouped_repositories.iterate_annex_whereis, but reads the location logs
+        from the git-annex branch directly: yields (file path, list of uuids) and fills
+        repositories with the uuid -> description association,
+        with_keys: yield (file path, list of uuids, key),
+        note: changes which git-annex has not yet committed to the branch are not seen,
+        unlike read_cached_locations, the snapshot is computed from scratch and not stored
+    """
+    snapshot = LocationSnapshot(path)
+    data = snapshot.build(rev_parse(path, treeish), rev_parse(path, ANNEX_BRANCH))
+    return snapshot_locations(path, data, repositories, omit_untrusted, with_keys)
+
+
+def read_locations(path, keys, logs=None):
+    """ yields (key, sorted list of uuids which hold the key) for the given keys """
+    if logs is None:
+        logs = location_logs(path)
+    requests = ((key, logs.get(key)) for key in keys)
+    for key, raw in cat_file_batch(path, requests):
+        yield key, sorted(parse_location_log(raw) if raw is not None else ())
+
+
+def rev_parse(path, revision):
+    """ returns the commit id of the revision (or None if it does not exist) """
+    process = subprocess.Popen(["git", "rev-parse", "--verify", "-q", revision],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=path)
+    output, _ = process.communicate()
+    return output.decode().strip() if process.returncode == 0 else None
+
+
+def diff_tree(path, old, new):
+    """ yields (status, new mode, new object, file path) of the files changed between two commits """
+    cmd = ["git", "diff-tree", "-r", "-z", "--no-renames", old, new]
+    with open(os.devnull, "w") as devnull:
+        output = subprocess.check_output(cmd, stderr=devnull, cwd=path)
+    entries = output.split(b"\0")
+    # entries: ':<old mode> <new mode> <old object> <new object> <status>', '<path>', ...
+    for info, filepath in zip(entries[0::2], entries[1::2]):
+        _, mode, _, obj, status = info.decode().split()
+        yield status, mode, obj, filepath.decode("UTF-8", errors="surrogateescape")
+
+
+class LocationSnapshot:
+    """
+        persistent snapshot of the file -> key and the key -> uuids association of a
+        repository, stored in its git directory and tagged with the commits of HEAD
+        and of the git-annex branch it was computed from: if they moved, only the
+        difference between the old and the new commits is applied
+    """
+
+    VERSION = 1
+    FILENAME = "mpex-locations.json"
+
+    def __init__(self, path):
+        # save options
+        self.path = path
+        git_dir = subprocess.check_output(["git", "rev-parse", "--git-dir"], cwd=path).decode().strip()
+        self.filename = os.path.join(path, git_dir, self.FILENAME)
+
+    def load(self):
+        """ load the snapshot, returns None if there is no usable snapshot """
+        try:
+            with io.open(self.filename, mode="rt", encoding="UTF8") as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        return data if data.get("version") == self.VERSION else None
+
+    def save(self, data):
+        """ save the snapshot (atomically) """
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        with io.open(tmp_filename, mode="wt", encoding="UTF8") as fd:
+            json.dump(data, fd, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_filename, self.filename)
+
+    def build(self, head, branch):
+        """ compute the snapshot from scratch """
+        files = dict(annexed_files(self.path, head)) if head is not None else {}
+        locations = dict(read_locations(self.path, set(files.values()))) if branch is not None else {}
+        return {"version": self.VERSION, "head": head, "branch": branch, "files": files, "locations": locations}
+
+    def apply_head_diff(self, data, head):
+        """ update the files of the snapshot to the commit head """
+        files = data["files"]
+
+        # symbolic links point to annexed content, other files only if they are small
+        changed = {}
+        for status, mode, obj, filepath in diff_tree(self.path, data["head"], head):
+            files.pop(filepath, None)
+            if status != "D" and mode in ("120000", "100644", "100755"):
+                changed[filepath] = mode, obj
+        sizes = dict(cat_file_batch(self.path, ((filepath, obj) for filepath, (mode, obj) in changed.items()
+                                                if mode != "120000"), check=True))
+        requests = (((filepath, mode), obj) for filepath, (mode, obj) in changed.items()
+                    if mode == "120000" or (sizes.get(filepath) or 0) <= MAX_POINTER_SIZE)
+
+        for (filepath, mode), content in cat_file_batch(self.path, requests):
+            key = key_from_blob(mode, content)
+            if key is not None:
+                files[filepath] = key
+
+        data["head"] = head
+
+    def apply_branch_diff(self, data, branch):
+        """ update the known locations of the snapshot to the git-annex branch commit branch """
+        locations = data["locations"]
+
+        # re-read the changed location logs of the known keys
+        requests = []
+        for status, _, obj, filepath in diff_tree(self.path, data["branch"], branch):
+            directory, _, filename = filepath.rpartition("/")
+            key = filename[:-len(".log")]
+            if directory and filename.endswith(".log") and key in locations:
+                requests.append((key, obj if status != "D" else None))
+
+        for key, raw in cat_file_batch(self.path, requests):
+            locations[key] = sorted(parse_location_log(raw) if raw is not None else ())
+
+        data["branch"] = branch
+
+    def update(self):
+        """ returns the up to date snapshot, it is saved if it changed """
+        head, branch = rev_parse(self.path, "HEAD"), rev_parse(self.path, ANNEX_BRANCH)
+
+        data = self.load()
+        if data is not None and data["head"] == head and data["branch"] == branch:
+            # nothing moved
+            return data
+
+        try:
+            if data is None or data["head"] is None or data["branch"] is None or head is None or branch is None:
+                raise ValueError("no base for an incremental update")
+            if data["head"] != head:
+                self.apply_head_diff(data, head)
+            if data["branch"] != branch:
+                self.apply_branch_diff(data, branch)
+        except (ValueError, subprocess.CalledProcessError):
+            # the old commits are not usable (e.g. they were garbage collected)
+            data = self.build(head, branch)
+        else:
+            # forget keys which are not used anymore and look up the new ones
+            keys = set(data["files"].values())
+            locations = {key: uuids for key, uuids in data["locations"].items() if key in keys}
+            locations.update(read_locations(self.path, keys - set(locations)) if keys - set(locations) else ())
+            data["locations"] = locations
+
+        self.save(data)
+        return data
+
+
+def snapshot_locations(path, data, repositories, omit_untrusted=False, with_keys=False):
+    """ yields the files of the snapshot data like read_branch_locations """
+    shown = trust_filter(path, repositories, omit_untrusted)
+
+    locations = data["locations"]
+
+    for filepath, key in data["files"].items():
+        uuids = shown(locations.get(key, ()))
+        yield (filepath, uuids, key) if with_keys else (filepath, uuids)
+
+
+def read_cached_locations(path, repositories, omit_untrusted=False, with_keys=False):
+    """
+        like read_branch_locations, but the locations are taken from the snapshot
+        of the repository, which is updated incrementally
+    """
+    data = LocationSnapshot(path).update()
+    return snapshot_locations(path, data, repositories, omit_untrusted, with_keys)
+
+
+def key_size(key):
+    """
+        returns the size encoded in the key ('<backend>-s<size>-...--<name>'),
+        None if the key does not specify its size
+    """
+    if not key:
+        return None
+    for field in key.split("--", 1)[0].split("-")[1:]:
+        if field.startswith("s") and field[1:].isdigit():
+            return int(field[1:])
+    return None
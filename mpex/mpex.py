@@ -1,17 +1,22 @@
 import os
 import argparse
+import concurrent.futures
+import contextlib
 import sys
 import textwrap
 import time
 import xdg
 
 from .lib import fuzzy_match
+from .lib import parallel
 from .lib.terminal import print_blue, print_red, print_green
 
 from . import application
 from . import show_edit
 
 from . import grouped_repositories
+from . import redundancy
+from . import structure_base
 
 CONFIG_PATH = xdg.XDG_CONFIG_HOME
 if not CONFIG_PATH:
@@ -23,7 +28,9 @@ def parse_annex_names(app, args):
     """ parse annexes supplied by the user """
     # if nothing is given, return all
     if not args.annex:
-        return app.annexes.get_all()
+        selected_annexes = app.annexes.get_all()
+        app.repositories.check(selected_annexes)
+        return selected_annexes
 
     # save
     annex_names = args.annex
@@ -42,6 +49,9 @@ def parse_annex_names(app, args):
         # add found annexes
         selected_annexes |= annexes
 
+    # the application is lazy, only check what is used
+    app.repositories.check(selected_annexes)
+
     return selected_annexes
 
 
@@ -59,6 +69,19 @@ apply_parser.add_argument('--remotempex', default="mpex", metavar="cmd",
                           help="remote mpex command (default: mpex)")
 apply_parser.add_argument('--hops', type=int, default=2,
                           help="when remote is given, the maximal number of hops")
+apply_parser.add_argument('--jobs', type=int, default=1, metavar="N",
+                          help="number of repositories which are processed in parallel (default: 1)")
+apply_parser.add_argument('--remote-jobs', type=int, default=1, metavar="N",
+                          help="number of remote hosts on which the command is executed concurrently (default: 1)")
+apply_parser.add_argument('--connect-timeout', type=int, default=None, metavar="SECONDS",
+                          help="timeout used when checking ssh connections (default: ssh's default)")
+apply_parser.add_argument('--connection-ttl', type=int, default=0, metavar="SECONDS",
+                          help="reuse the stored status of ssh connections if it is younger than"
+                               " the given number of seconds (default: 0, i.e. always check)")
+apply_parser.add_argument('--refresh-connections', action="store_true",
+                          help="check all connections, even if there is a recently stored status")
+apply_parser.add_argument('--no-ssh-multiplexing', action="store_true",
+                          help="do not share one ssh connection per host between all ssh sessions")
 apply_parser.add_argument('--simulate', action="store_true",
                           help="only simulate the commands")
 apply_parser.add_argument('--verbose', type=int,
@@ -66,17 +89,88 @@ apply_parser.add_argument('--verbose', type=int,
                           help="verbosity level: 0 [1] 2")
 
 
-def apply_function(args, f):
-    """ apply f to all given annex_names """
+def remote_command(args):
+    """ compute the remote command based on the current command """
+    cmd = sys.argv[:]
+
+    # adjust command name
+    cmd[0] = args.remotempex
+
+    # adjust hops
+    for i, piece in enumerate(cmd):
+        if piece == "--hops":
+            # format: --hops n, new command line: --hops (n-1)
+            cmd[i + 1] = str(args.hops - 1)
+            break
+        elif piece.startswith("--hops="):
+            # format: --hops=n, new command line: --hops=(n-1)
+            cmd[i] = "--hops=%s" % (args.hops - 1)
+            break
+    else:
+        # no hops argument in the original command given: just add it
+        cmd = cmd[:2] + ["--hops", str(args.hops - 1)] + cmd[2:]
+
+    return cmd
+
+
+def execute_remotely_concurrently(connections, cmd, jobs):
+    """
+        execute cmd on the target hosts of all connections concurrently (at most jobs
+        at the same time), the output is prefixed with the host name, afterwards a
+        table with the exit status of every host is shown
+    """
+    names = ", ".join(sorted(c.dest.name for c in connections))
+
+    # execute the command on the target machines
+    print()
+    print_green("executing command on hosts %s" % names)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        statuses = list(executor.map(lambda c: c.execute_remotely_streamed(cmd), connections))
+    print_green("command finished on hosts %s" % names)
+    print()
+
+    # exit status table
+    table = [["Host", "Exit status"]]
+    for connection, status in sorted(zip(connections, statuses), key=lambda cs: cs[0].dest.name):
+        if status is None:
+            status = "not executed"
+        elif status != 0:
+            status = "\033[1;31m%d (failed)\033[0m" % status
+        table.append([connection.dest.name, str(status)])
+    show_edit.print_table(table)
+    print()
+
+
+def create_application(args):
+    """ create the application with the options of apply_parser """
+    return application.Application(CONFIG_PATH, verbose=args.verbose, simulate=args.simulate,
+                                   connect_timeout=args.connect_timeout,
+                                   connection_ttl=args.connection_ttl,
+                                   refresh_connections=args.refresh_connections,
+                                   ssh_multiplexing=not args.no_ssh_multiplexing,
+                                   lazy=True)
+
+
+def apply_function(args, f, uses_connections=True):
+    """
+        apply f to all given annex_names, uses_connections indicates
+        that f needs to know which connections are online
+    """
     # create application
-    app = application.Application(CONFIG_PATH, verbose=args.verbose, simulate=args.simulate)
+    app = create_application(args)
 
     # parse annex names
     selected_annexes = parse_annex_names(app, args)
 
+    # machine readable output (e.g. group --format csv) keeps stdout free of messages
+    machine_readable = getattr(args, "format", "text") != "text"
+
+    def messages():
+        return contextlib.redirect_stdout(sys.stderr) if machine_readable else contextlib.nullcontext()
+
     # give the user the chance to understand what the program is doing
     names = ", ".join(sorted(annex.name for annex in selected_annexes))
-    if args.verbose <= app.VERBOSE_IMPORTANT:
+    if args.verbose <= app.VERBOSE_IMPORTANT and not machine_readable:
         print()
         print("selected annexes: %s" % names)
         print()
@@ -124,6 +218,11 @@ def apply_function(args, f):
         # default: only local
         local_execution, remote_execution = True, False
 
+    # check all connections leaving the current host at once
+    if uses_connections or (remote_execution and args.hops > 0):
+        with messages():
+            app.connections.probe(app.get_connections())
+
     # list of connections
     connections = []
 
@@ -142,15 +241,27 @@ def apply_function(args, f):
 
         # state the connected hosts
 
-        if connections:
-            print("found connections to the following hosts:", ", ".join(sorted(c.dest.name for c in connections)))
-        else:
-            print("found no connections to other hosts")
+        with messages():
+            if connections:
+                print("found connections to the following hosts:", ", ".join(sorted(c.dest.name for c in connections)))
+            else:
+                print("found no connections to other hosts")
 
     # if local execution is requested, add the trivial connection
     if local_execution:
         connections.append(None)
 
+    # repositories for which f failed (only in parallel mode)
+    failures = []
+
+    # if wanted, start the command on all remote hosts at once
+    if args.remote_jobs > 1:
+        remote_connections = [c for c in connections if c is not None and c.supports_remote_execution()]
+        if remote_connections:
+            execute_remotely_concurrently(remote_connections, remote_command(args), args.remote_jobs)
+        # only the remaining connections are handled below
+        connections = [c for c in connections if c is None or not c.supports_remote_execution()]
+
     # actually execute f
     for connection in connections:
         if connection is None or connection.is_local():
@@ -162,45 +273,44 @@ def apply_function(args, f):
                 # otherwise, all repositories which can be accessed via the connection
                 repositories = app.get_connected_repositories(connection)
 
-            # iterate over all found repositories
-            for repo in sorted(repositories, key=r_key):
-                # check if the repo belongs to a selected annex
-                # and that it is not special, if both conditions
-                # are true, execute f
-                if repo.annex in selected_annexes and not repo.is_special():
+            # check if the repo belongs to a selected annex
+            # and that it is not special, if both conditions
+            # are true, execute f
+            repositories = [repo for repo in sorted(repositories, key=r_key)
+                            if repo.annex in selected_annexes and not repo.is_special()]
+
+            if args.jobs > 1:
+                # process the repositories in parallel, the output is buffered per repository
+                failures.extend(parallel.run_parallel(repositories, f, args.jobs))
+            else:
+                # iterate over all found repositories
+                for repo in repositories:
                     f(repo)
 
         elif connection.supports_remote_execution():
             # if the connection allows remote execution, first compute the remote command
             # based on the current command
-            cmd = sys.argv[:]
-
-            # adjust command name
-            cmd[0] = args.remotempex
-
-            # adjust hops
-            for i, piece in enumerate(cmd):
-                if piece == "--hops":
-                    # format: --hops n, new command line: --hops (n-1)
-                    cmd[i + 1] = str(args.hops - 1)
-                    break
-                elif piece.startswith("--hops="):
-                    # format: --hops=n, new command line: --hops=(n-1)
-                    cmd[i] = "--hops=%s" % (args.hops - 1)
-                    break
-            else:
-                # no hops argument in the original command given: just add it
-                cmd = cmd[:2] + ["--hops", str(args.hops - 1)] + cmd[2:]
+            cmd = remote_command(args)
 
             # execute the command on the target machine
-            print()
-            print_green("executing command on host %s" % connection.dest.name)
+            with messages():
+                print()
+                print_green("executing command on host %s" % connection.dest.name)
             connection.execute_remotely(cmd, ignore_exception=True, print_ignored_exception=True)
-            print_green("command finished on host %s" % connection.dest.name)
-            print()
+            with messages():
+                print_green("command finished on host %s" % connection.dest.name)
+                print()
         else:
             raise ValueError("Connection %s does not permit remote execution." % connection)
 
+    # summarise the failures
+    if failures:
+        print()
+        print_red("the command failed for the following repositories:", sep='')
+        for repo, exception in failures:
+            print("Annex: %s Path: %s Error: %s" % (repo.annex.name, repo.local_path, exception))
+        raise application.InterruptedException("the command failed for %d repositories" % len(failures))
+
 
 #
 # initialise repositories
@@ -249,7 +359,7 @@ def func_finalise(args):
     def repo_finalise(repo):
         repo.finalise()
 
-    apply_function(args, repo_finalise)
+    apply_function(args, repo_finalise, uses_connections=False)
 
 
 #
@@ -278,6 +388,13 @@ def init_copy(parsers):
     parser.add_argument('--files', default=None, help="files expression for the local host")
     parser.add_argument('--strict', action="store_true", help="apply strict")
     parser.add_argument('--nostrict', action="store_true", help="apply no strict")
+    parser.add_argument('--noplan', action="store_true",
+                        help="call git-annex for every repository instead of planning the transfers at once")
+    parser.add_argument('--annex-jobs', type=int, default=None,
+                        help="number of parallel transfers per repository (limited by the connection's jobs), "
+                             "repositories are served concurrently")
+    parser.add_argument('--estimate', action="store_true",
+                        help="only print the bytes which would be transferred (dry run)")
     parser.set_defaults(func=func_copy)
 
 
@@ -290,7 +407,8 @@ def func_copy(args):
         strict = False
 
     def repo_copy(repo):
-        repo.copy(copy_all=args.all, files=args.files, strict=strict)
+        repo.copy(copy_all=args.all, files=args.files, strict=strict, plan=not args.noplan,
+                  jobs=args.annex_jobs, estimate=args.estimate)
 
     apply_function(args, repo_copy)
 
@@ -305,19 +423,98 @@ def init_group(parsers):
                         help="number of printed lines per repository (default: 5)")
     parser.add_argument('--no-untrusted', action="store_true",
                         help="only show trusted repositories")
+    parser.add_argument('--source', choices=("whereis", "branch"), default="whereis",
+                        help="read the locations via 'git annex whereis' (default) or directly "
+                             "from the git-annex branch (faster, ignores uncommitted git-annex changes)")
+    parser.add_argument('--all', action="store_true",
+                        help="one combined report of all selected annexes hosted on this host, "
+                             "their locations are read in parallel (see --jobs)")
+    parser.add_argument('--format', choices=("text", "jsonl", "csv"), default="text",
+                        help="print the report as text (default) or the complete report as JSON lines or CSV, "
+                             "use --all to get the records of several annexes in one report")
+    parser.add_argument('--summary', default=None, metavar="FILE",
+                        help="with --all: write a JSON summary of the files per location set "
+                             "and per annex to FILE ('-' for stdout, only with --format text)")
     parser.set_defaults(func=func_group)
 
 
 def func_group(args):
+    # the summary would end the stream of records
+    if args.summary == "-" and args.format != "text":
+        print("WARNING: --summary - cannot be combined with --format %s, write the summary to a file" % args.format)
+        sys.exit(1)
+
+    if args.all:
+        # gather all selected repositories hosted on this host
+        app = create_application(args)
+        selected_annexes = parse_annex_names(app, args)
+        repositories = sorted((repo for repo in app.get_hosted_repositories()
+                               if repo.annex in selected_annexes and not repo.is_special()),
+                              key=lambda r: r.annex.name)
+
+        if app.verbose <= app.VERBOSE_IMPORTANT and args.format == "text":
+            print_blue("grouping repositories of", ", ".join(repo.annex.name for repo in repositories))
+            print()
+
+        annexes = [(repo.annex.name, repo.local_path) for repo in repositories]
+        grouped_repositories.do_combined_report(annexes, args.lines, args.no_untrusted, source=args.source,
+                                                jobs=args.jobs, summary_path=args.summary,
+                                                output_format=args.format)
+        return
+
     def repo_group(repo):
+        if args.format != "text":
+            # only the records are printed, the header is written once below
+            grouped_repositories.do_report(repo.local_path, args.lines, args.no_untrusted, source=args.source,
+                                           output_format=args.format, annex=repo.annex.name, header=False)
+            return
+
         if repo.app.verbose <= repo.app.VERBOSE_IMPORTANT:
             print_blue("grouping repositories of", repo.annex.name, "in", repo.path)
             print()
 
-        grouped_repositories.do_report(repo.local_path, args.lines, args.no_untrusted)
+        grouped_repositories.do_report(repo.local_path, args.lines, args.no_untrusted, source=args.source)
         print()
 
-    apply_function(args, repo_group)
+    # the CSV header comes first, even if the repositories are processed in parallel
+    if args.format != "text":
+        grouped_repositories.write_records([], sys.stdout, args.format)
+        sys.stdout.flush()
+
+    apply_function(args, repo_group, uses_connections=False)
+
+
+#
+# analyse the redundancy of repositories
+#
+def init_redundancy(parsers):
+    parser = parsers.add_parser('redundancy', help='find files with too few copies', parents=[apply_parser])
+    parser.add_argument('annex', nargs='*', help="annex names")
+    parser.add_argument('--numcopies', type=int, default=2,
+                        help="number of copies in trusted or semitrusted repositories a file needs (default: 2)")
+    parser.add_argument('--depth', type=int, default=2,
+                        help="depth of the directories files at risk are summed up in (default: 2)")
+    parser.add_argument('--lines', type=int, default=5,
+                        help="number of printed directories (default: 5)")
+    parser.add_argument('--source', choices=("whereis", "branch"), default="whereis",
+                        help="read the locations via 'git annex whereis' (default) or from the git-annex branch")
+    parser.set_defaults(func=func_redundancy)
+
+
+def func_redundancy(args):
+    def repo_redundancy(repo):
+        if repo.app.verbose <= repo.app.VERBOSE_IMPORTANT:
+            print_blue("analysing the redundancy of", repo.annex.name, "in", repo.path)
+            print()
+
+        # the trust levels of the repositories known to mpex
+        uuids = repo.annex_uuids()
+        trust = {uuids[r.description]: r.trust for r in repo.annex.repositories() if r.description in uuids}
+
+        redundancy.do_analysis(repo.local_path, trust, args.numcopies, args.depth, args.lines, source=args.source)
+        print()
+
+    apply_function(args, repo_redundancy, uses_connections=False)
 
 
 #
@@ -346,8 +543,8 @@ def func_command(args):
     args.annex = None
 
     def repo_command(repo):
-        # change path
-        repo.change_path()
+        # check path, the command is run in the repository
+        repo.repository_path()
         if repo.app.verbose <= repo.app.VERBOSE_IMPORTANT:
             print_blue("running the command for", repo.annex.name, "in", repo.local_path)
         # run the command in the directory
@@ -355,7 +552,7 @@ def func_command(args):
         if repo.app.verbose <= repo.app.VERBOSE_IMPORTANT:
             print()
 
-    apply_function(args, repo_command)
+    apply_function(args, repo_command, uses_connections=False)
 
 
 #
@@ -454,8 +651,8 @@ def init_set_host(parsers):
 
 
 def func_set_host(args):
-    # create application
-    app = application.Application(CONFIG_PATH)
+    # create application, only the hosts are needed
+    app = application.Application(CONFIG_PATH, lazy=True)
 
     try:
         host = app.hosts.fuzzy_match(args.host)
@@ -465,6 +662,24 @@ def func_set_host(args):
         print("an error has occurred: %s" % e.args[0])
 
 
+#
+# config store
+#
+def init_store(parsers):
+    parser = parsers.add_parser('store', help='convert the layout of the stored configuration')
+    parser.add_argument('layout', choices=structure_base.ConfigStore.LAYOUTS,
+                        help="one file per object (files) or one file for everything (snapshot)")
+    parser.set_defaults(func=func_store)
+
+
+def func_store(args):
+    # create application
+    app = application.Application(CONFIG_PATH)
+
+    print("converting the configuration from %s to %s." % (app.config_store.layout(), args.layout))
+    app.migrate_config_store(args.layout)
+
+
 #
 # migrate
 #
@@ -512,12 +727,14 @@ def run_parser():
     init_reinit(subparsers)
     init_finalise(subparsers)
     init_group(subparsers)
+    init_redundancy(subparsers)
     init_sync(subparsers)
     init_copy(subparsers)
     init_command(subparsers)
     init_show(subparsers)
     init_edit(subparsers)
     init_set_host(subparsers)
+    init_store(subparsers)
     init_migrate(subparsers)
 
     # parse arguments and call function
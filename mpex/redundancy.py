@@ -0,0 +1,122 @@
+import collections
+import os
+
+from . import grouped_repositories
+from . import location_index
+
+# risk categories, from the worst to the best
+LOST = "lost"
+UNTRUSTED_ONLY = "untrusted only"
+UNDER_REPLICATED = "under-replicated"
+SAFE = "safe"
+CATEGORIES = (LOST, UNTRUSTED_ONLY, UNDER_REPLICATED, SAFE)
+
+
+class RedundancyAnalysis:
+    """
+        aggregates the risk of losing files: the risk is judged once per location set,
+        every file only adds its file count and size to the totals of its category and,
+        if it is at risk, to the totals of its directory (cut off at the given depth)
+    """
+
+    def __init__(self, trust, numcopies=2, depth=2):
+        """ trust: uuid -> trust level (see Repository.TRUST_LEVEL), default: semitrust """
+        # save options
+        self.trust = trust
+        self.numcopies = numcopies
+        self.depth = depth
+
+        # location set id -> category
+        self.location_sets = grouped_repositories.LocationSets()
+        self._categories = []
+
+        # category -> [files, bytes, files of unknown size]
+        self.totals = {category: [0, 0, 0] for category in CATEGORIES}
+        # (directory, category) -> [files, bytes, files of unknown size]
+        self.directories = collections.defaultdict(lambda: [0, 0, 0])
+
+    def categorise(self, uuids):
+        """ judges the risk of a file held by the uuids """
+        levels = [self.trust.get(uuid, "semitrust") for uuid in uuids]
+        # untrusted repositories do not count as copies
+        copies = sum(1 for level in levels if level != "untrust")
+        if not levels:
+            return LOST
+        elif not copies:
+            return UNTRUSTED_ONLY
+        elif copies < self.numcopies:
+            return UNDER_REPLICATED
+        else:
+            return SAFE
+
+    def category(self, location_id):
+        """ returns the (cached) category of the location set """
+        while len(self._categories) <= location_id:
+            self._categories.append(self.categorise(self.location_sets.uuids(len(self._categories))))
+        return self._categories[location_id]
+
+    def add(self, filepath, uuids, size):
+        """ add a file held by uuids with the given size (or None if the size is unknown) """
+        category = self.category(self.location_sets.intern(uuids))
+
+        totals = self.totals[category]
+        self._count(totals, size)
+
+        # remember the directories of the files at risk
+        if category != SAFE:
+            directory = os.path.sep.join(grouped_repositories.full_split(filepath)[0][:self.depth]) or "."
+            self._count(self.directories[directory, category], size)
+
+    @staticmethod
+    def _count(totals, size):
+        totals[0] += 1
+        if size is None:
+            totals[2] += 1
+        else:
+            totals[1] += size
+
+    def add_all(self, files):
+        """ add all files, an iterable of (file path, uuids, key) """
+        for filepath, uuids, key in files:
+            self.add(filepath, uuids, location_index.key_size(key))
+
+    def at_risk(self):
+        """ returns the list of (directory, category, files, bytes, files of unknown size), most bytes first """
+        entries = [(directory, category) + tuple(totals)
+                   for (directory, category), totals in self.directories.items()]
+        entries.sort(key=lambda entry: (CATEGORIES.index(entry[1]), -entry[3], -entry[2], entry[0]))
+        return entries
+
+
+def format_totals(files, size, unknown):
+    """ formats file count and size """
+    text = "%d files, %s" % (files, grouped_repositories.format_size(size))
+    if unknown:
+        text += " (%d files of unknown size)" % unknown
+    return text
+
+
+def print_analysis(analysis, number_of_content_lines=5):
+    """ print the totals of all categories and the directories at risk """
+    print("numcopies: %d" % analysis.numcopies)
+    for category in CATEGORIES:
+        print("%-17s %s" % (category + ":", format_totals(*analysis.totals[category])))
+
+    entries = analysis.at_risk()
+    if not entries:
+        return
+
+    print()
+    print("directories at risk:")
+    for directory, category, files, size, unknown in entries[:number_of_content_lines]:
+        print("\t", directory + os.path.sep, "[%s]" % category, format_totals(files, size, unknown))
+    if len(entries) > number_of_content_lines:
+        print("\t<omitted %d directories>" % (len(entries) - number_of_content_lines))
+
+
+def do_analysis(path, trust, numcopies=2, depth=2, number_of_content_lines=5, source="whereis"):
+    """ analyse the annex at path, trust: uuid -> trust level """
+    analysis = RedundancyAnalysis(trust, numcopies, depth)
+    analysis.add_all(grouped_repositories.read_locations(path, {}, source=source, with_keys=True))
+    print_analysis(analysis, number_of_content_lines)
+    return analysis
@@ -191,6 +191,7 @@ def create_connections_table(env, connections):
 
     # determine if additional columns have to be shown
     withalwayson = any(conn.always_on for conn in connections)
+    withjobs = any(conn.jobs is not None for conn in connections)
 
     # we build a table: a 2 dimensional array
     table = []
@@ -199,6 +200,7 @@ def create_connections_table(env, connections):
     header = ["Source", "Destination", "Path", ]
     # additional columns:
     if withalwayson: header.append("Always on")
+    if withjobs: header.append("Jobs")
     # the first line is the header
     table.append(header)
 
@@ -217,6 +219,8 @@ def create_connections_table(env, connections):
         # further columns
         if withalwayson:
             row.append("yes" if conn.always_on else "")
+        if withjobs:
+            row.append(str(conn.jobs) if conn.jobs is not None else "")
         # append row
         table.append(row)
     return connections, table
@@ -447,6 +451,13 @@ def repo_path_pp(s):
     return s
 
 
+def jobs_pp(s):
+    """ the number of jobs has to be positive or empty """
+    if s and (not s.isdigit() or int(s) < 1):
+        raise ValueError("has to be a positive number")
+    return s
+
+
 def connection_path_pp(s):
     """ test has to be absolute or a ssh path """
     if not s.startswith("/") and not s.startswith("ssh://"):
@@ -493,6 +504,7 @@ def edit_hosts(env, obj):
             else:
                 # overwrite (very unsafe)
                 obj._name = name
+                env.app.edited(obj)
         except Exception as e:
             print_red("an error occurred:", e.args[0])
             return
@@ -534,6 +546,7 @@ def edit_annexes(env, obj):
             else:
                 # overwrite (very unsafe)
                 obj._name = name
+                env.app.edited(obj)
         except Exception as e:
             print_red("an error occurred:", e.args[0])
             return
@@ -624,6 +637,7 @@ def edit_repositories(env, obj):
                     obj._data["description"] = description
                 elif "description" in obj._data:
                     del obj._data["description"]
+                env.app.edited(obj)
         except Exception as e:
             print_red("an error occurred:", e.args[0])
             return
@@ -753,6 +767,7 @@ def edit_connections(env, obj):
             else:
                 # overwrite (very unsafe)
                 obj._source, obj._dest, obj._path = source, destination, path
+                env.app.edited(obj)
         except Exception as e:
             print_red("an error occurred:", e.args[0])
             return
@@ -773,6 +788,12 @@ def edit_connections(env, obj):
                       "default": str(obj.always_on).lower(),
                       "postprocessor": valid_values_pp(("true", "false"))})
 
+    # 2. question: jobs
+    questions.append({"name": "jobs",
+                      "description": "maximal number of parallel transfers, leave empty for no limit",
+                      "default": str(obj.jobs) if obj.jobs is not None else "",
+                      "postprocessor": jobs_pp})
+
     # actually ask the questions
     answers = ask_questions(questions)
 
@@ -785,8 +806,10 @@ def edit_connections(env, obj):
     try:
         # parse values
         alwayson = (answers["alwayson"] == 'true')
+        jobs = int(answers["jobs"]) if answers["jobs"] else None
         # set values
         obj.always_on = alwayson
+        obj.jobs = jobs
     except Exception as e:
         print_red("an error occurred:", e.args[0])
         return
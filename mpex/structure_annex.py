@@ -60,7 +60,7 @@ class Annex:
 
     def repositories(self):
         """ return the repositories belonging to the current annex """
-        return {repo for repo in self.app.repositories.get_all() if repo.annex == self}
+        return self.app.repositories.find("annex", self)
 
     #
     # hashable type methods, hashable is needed for dict keys and sets
@@ -1,3 +1,4 @@
+import collections
 import json
 import os.path
 import io
@@ -5,6 +6,193 @@ import hashlib
 import re
 
 
+class ConfigStore:
+    """
+        storage of the raw data of all collections, two layouts are supported:
+        one file per object (files) or one snapshot file holding all collections
+        (snapshot), the snapshot is used if it exists and is read only once.
+        every object is stored under a name which is derived from its key and
+        its content, so an unchanged object never has to be written again
+    """
+
+    FILES = "files"
+    SNAPSHOT = "snapshot"
+    LAYOUTS = (FILES, SNAPSHOT)
+
+    SNAPSHOT_FILENAME = "config_snapshot.json"
+    VERSION = 1
+
+    def __init__(self, path):
+        # save options
+        self.path = path
+        # the file names in the config directory, listed on first use
+        self._listing = None
+        # collection prefix -> name -> raw data, loaded on first use
+        self._snapshot = None
+        # the snapshot has changes which are not written yet
+        self._snapshot_dirty = False
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.path, self.SNAPSHOT_FILENAME)
+
+    def _list(self):
+        """ returns the set of file names in the config directory (listed once) """
+        if self._listing is None:
+            self._listing = set(os.listdir(self.path))
+        return self._listing
+
+    def layout(self):
+        """ the layout in use """
+        return self.SNAPSHOT if self.SNAPSHOT_FILENAME in self._list() else self.FILES
+
+    @staticmethod
+    def object_name(file_prefix, key, raw_json):
+        """ the name of an object: prefix, readable key and a hash of the content """
+        raw_json_hash = hashlib.sha256(raw_json.encode("UTF8")).hexdigest()[:16]
+
+        # create readable key
+        readable_key = "_".join(str(x) for x in key) if isinstance(key, tuple) else str(key)
+        readable_key = readable_key.lower()
+        readable_key = re.sub("[^a-zA-Z0-9]", "_", readable_key)
+
+        return file_prefix + "__" + readable_key + "__" + raw_json_hash
+
+    @staticmethod
+    def dumps(raw_data):
+        return json.dumps(raw_data, ensure_ascii=False, indent=4, sort_keys=True)
+
+    def load(self, file_prefix):
+        """ returns the list of (name, raw data) of all objects of the collection """
+        if self.layout() == self.SNAPSHOT:
+            return list(self._load_snapshot().get(file_prefix, {}).items())
+        else:
+            return self._load_files(file_prefix)
+
+    def save(self, file_prefix, changes):
+        """
+            saves the changed objects of a collection, changes: list of (name, key, raw data),
+            the name under which the object is stored (None for new objects), raw data is None
+            for removed objects. returns the list of the new names (None for removed objects)
+        """
+        snapshot = self.layout() == self.SNAPSHOT
+        if snapshot:
+            objects = self._load_snapshot().setdefault(file_prefix, {})
+
+        names = []
+        for old_name, key, raw_data in changes:
+            name = None
+            if raw_data is not None:
+                raw_json = self.dumps(raw_data)
+                name = self.object_name(file_prefix, key, raw_json)
+                # the content is part of the name: if the name agrees, the content does as well
+                if name != old_name:
+                    if snapshot:
+                        objects[name] = raw_data
+                    else:
+                        self._write_file(name, raw_json)
+
+            if old_name is not None and old_name != name:
+                if snapshot:
+                    objects.pop(old_name, None)
+                else:
+                    self._remove_file(old_name)
+
+            names.append(name)
+
+        # the snapshot is written by flush
+        if snapshot and changes:
+            self._snapshot_dirty = True
+
+        return names
+
+    def flush(self):
+        """ writes the snapshot, if it has changed """
+        if self._snapshot_dirty:
+            self._write_snapshot()
+
+    def migrate(self, layout, collections):
+        """ converts the stored collections (list of (file prefix, list of (key, raw data))) to the layout """
+        assert layout in self.LAYOUTS, "unknown layout %s" % layout
+        if layout == self.layout():
+            return
+
+        # name -> raw data per collection
+        converted = {}
+        for file_prefix, items in collections:
+            converted[file_prefix] = {}
+            for key, raw_data in items:
+                converted[file_prefix][self.object_name(file_prefix, key, self.dumps(raw_data))] = raw_data
+
+        if layout == self.SNAPSHOT:
+            # write the snapshot first, it takes precedence over left over files
+            self._snapshot = converted
+            self._write_snapshot()
+            for file_prefix, _ in collections:
+                for filename in [f for f in self._list() if f.startswith(file_prefix)]:
+                    self._remove_file(filename)
+        else:
+            # write the files first, they are used as soon as the snapshot is gone
+            for objects in converted.values():
+                for name, raw_data in objects.items():
+                    self._write_file(name, self.dumps(raw_data))
+            self._remove_file(self.SNAPSHOT_FILENAME)
+            self._snapshot = None
+            self._snapshot_dirty = False
+
+    def _load_snapshot(self):
+        """ reads the snapshot (once) """
+        if self._snapshot is None:
+            with io.open(self.snapshot_path, mode="rt", encoding="UTF8") as fd:
+                raw_data = json.load(fd)
+            assert raw_data.get("version") == self.VERSION, \
+                "unknown version of %s: %s" % (self.snapshot_path, raw_data.get("version"))
+            self._snapshot = raw_data["collections"]
+        return self._snapshot
+
+    def _write_snapshot(self):
+        """ writes the snapshot compactly """
+        raw_json = json.dumps({"version": self.VERSION, "collections": self._snapshot},
+                              ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        self._write_file(self.SNAPSHOT_FILENAME, raw_json)
+        self._snapshot_dirty = False
+
+    def _write_file(self, filename, content):
+        """ writes the file atomically """
+        # write to a temporary (hidden) file and rename it, so concurrent runs never see a partial file
+        path = os.path.join(self.path, filename)
+        tmp_path = os.path.join(self.path, ".%s.%d.tmp" % (filename, os.getpid()))
+        with io.open(tmp_path, mode="wt", encoding="UTF8") as fd:
+            fd.write(content)
+        os.replace(tmp_path, path)
+        self._list().add(filename)
+
+    def _remove_file(self, filename):
+        """ removes the file if it exists """
+        try:
+            os.remove(os.path.join(self.path, filename))
+        except FileNotFoundError:
+            pass
+        self._list().discard(filename)
+
+    def _load_files(self, file_prefix):
+        """ reads one file per object """
+        result = []
+
+        # check all files in the config directory
+        for filename in sorted(self._list()):
+            if not filename.startswith(file_prefix):
+                continue
+
+            path = os.path.join(self.path, filename)
+            # open the file if it exists
+            with io.open(path, mode="rt", encoding="UTF8") as fd:
+                # decode object (json file)
+                result.append((filename, json.load(fd)))
+
+        return result
+
+
 class Collection:
     def __init__(self, app, file_prefix, cls):
         # save options
@@ -14,6 +202,18 @@ class Collection:
         self.file_prefix = file_prefix
         # internal dictionary which tracks all known objects
         self._objects = {}
+        # id of the object -> key (to find the key of a changed object)
+        self._keys = {}
+        # key -> name under which the object is stored
+        self._names = {}
+        # keys of the objects which were created or changed since the last save
+        self._changed = set()
+        # names of the removed objects
+        self._removed = set()
+        # secondary indexes: index name -> value -> key -> object
+        self._indexes = collections.defaultdict(lambda: collections.defaultdict(dict))
+        # key -> index name -> value under which the object is indexed
+        self._indexed = {}
         # load objects
         self.load()
 
@@ -21,55 +221,120 @@ class Collection:
         """ loads all known objects """
         # clear tracker
         self._objects.clear()
+        self._keys.clear()
+        self._names.clear()
+        self._indexes.clear()
+        self._indexed.clear()
 
-        # check all files in the config directory
-        for filename in os.listdir(self.app.path):
-            if not filename.startswith(self.file_prefix):
-                continue
+        for name, raw_data in self.app.config_store.load(self.file_prefix):
+            # convert raw object data
+            obj = self.raw_data_to_arg_dict(raw_data)
+            # create the object
+            obj = self.create(**obj)
+            # remember where it is stored
+            self._names[self._keys[id(obj)]] = name
 
-            path = os.path.join(self.app.path, filename)
-            # open the file if it exists
-            with io.open(path, mode="rt", encoding="UTF8") as fd:
-                # decode object (json file)
-                raw_data = json.load(fd)
-                # convert raw object data
-                obj = self.raw_data_to_arg_dict(raw_data)
-                # create the object
-                self.create(**obj)
+        # everything is stored
+        self._changed.clear()
+        self._removed.clear()
 
-    def save(self):
-        """ saves all known objects """
-        # get set of all known objects
-        used_names = set()
+    def items(self):
+        """ returns the list of (key, raw data) of all known objects """
+        return [(key, self.obj_to_raw_data(obj)) for key, obj in self._objects.items()]
 
-        for key, data in self._objects.items():
-            # convert data and calculate hash
-            raw_data = self.obj_to_raw_data(data)
-            raw_json = json.dumps(raw_data, ensure_ascii=False, indent=4, sort_keys=True)
-            raw_json_hash = hashlib.sha256(raw_json.encode("UTF8")).hexdigest()[:16]
+    def changed(self, obj):
+        """ marks the object as changed, it is written by the next save """
+        key = self._keys[id(obj)]
+        self._changed.add(key)
+        # the indexed values may have changed as well
+        self._index(key)
 
-            # create readable key
-            readable_key = "_".join(str(x) for x in key) if isinstance(key, tuple) else str(key)
-            readable_key = readable_key.lower()
-            readable_key = re.sub("[^a-zA-Z0-9]", "_", readable_key)
+    def remove(self, obj):
+        """ removes the object """
+        key = self._keys.pop(id(obj))
+        self._unindex(key)
+        del self._objects[key]
+        self._changed.discard(key)
+        name = self._names.pop(key, None)
+        if name is not None:
+            self._removed.add(name)
 
-            filename = self.file_prefix + "__" + readable_key + "__" + raw_json_hash
-            path = os.path.join(self.app.path, filename)
+    def save(self, flush=True):
+        """
+            saves all created, changed and removed objects, flush: write the snapshot
+            (see ConfigStore) at once, otherwise the caller flushes the store
+        """
+        changed = sorted(self._changed, key=str)
+        changes = [(self._names.get(key), key, self.obj_to_raw_data(self._objects[key])) for key in changed]
+        changes += [(name, None, None) for name in sorted(self._removed)]
 
-            used_names.add(filename)
+        names = self.app.config_store.save(self.file_prefix, changes)
 
-            with io.open(path, mode="wt", encoding="UTF8") as fd:
-                fd.write(raw_json)
+        # remember the new names
+        for key, name in zip(changed, names):
+            self._names[key] = name
+        self._changed.clear()
+        self._removed.clear()
 
-        # delete old files
-        seen_filenames = {filename for filename in os.listdir(self.app.path) if filename.startswith(self.file_prefix)}
-        for filename in seen_filenames - used_names:
-            os.remove(os.path.join(self.app.path, filename))
+        if flush:
+            self.app.config_store.flush()
 
     def get_all(self):
         """ return all known objects """
         return set(self._objects.values())
 
+    def find(self, index, value):
+        """ return all objects whose value in the index (see index_values) is value """
+        return set(self._indexes[index].get(value, {}).values())
+
+    def _index(self, key):
+        """ (re)index the object """
+        self._unindex(key)
+        obj = self._objects[key]
+        values = self.index_values(obj)
+        for index, value in values.items():
+            self._indexes[index][value][key] = obj
+        self._indexed[key] = values
+
+    def _unindex(self, key):
+        """ remove the object from all indexes """
+        for index, value in self._indexed.pop(key, {}).items():
+            objects = self._indexes[index][value]
+            del objects[key]
+            if not objects:
+                del self._indexes[index][value]
+
+    def rekey(self):
+        """
+            recompute the keys and the indexes of all objects, needed after an (unsafe)
+            edit changed the data they are computed from, e.g. the name of a host
+        """
+        # the old keys may not be found by hashing anymore, so match them by identity
+        old_keys = {id(obj): key for key, obj in self._objects.items()}
+        names = {id(key): name for key, name in self._names.items()}
+        changed = {id(key) for key in self._changed}
+        objects = list(self._objects.values())
+
+        self._objects, self._keys, self._names, self._changed = {}, {}, {}, set()
+        self._indexes.clear()
+        self._indexed.clear()
+
+        for obj in objects:
+            old_key = old_keys[id(obj)]
+            key = self.key_from_object(obj)
+            assert key not in self._objects, "object with key %s already exists: %s" % (key, self._objects[key])
+            self._objects[key] = obj
+            self._keys[id(obj)] = key
+            if id(old_key) in names:
+                self._names[key] = names[id(old_key)]
+            if id(old_key) in changed:
+                self._changed.add(key)
+            self._index(key)
+
+    def key_from_object(self, obj):
+        """ compute the key of an object """
+        return self.key_from_arguments(**self.raw_data_to_arg_dict(self.obj_to_raw_data(obj)))
+
     def get(self, *args, **kwargs):
         """
             get the given object, signature matches the signature of cls, however
@@ -90,10 +355,17 @@ class Collection:
         assert key not in self._objects, "object with key %s already exists: %s" % (key, self._objects[key])
         # create it
         self._objects[key] = self.cls(self.app, *args, **kwargs)
+        self._keys[id(self._objects[key])] = key
+        self._changed.add(key)
+        self._index(key)
         # return object
         return self._objects[key]
 
     # virtual methods
+    def index_values(self, obj):
+        """ returns the values under which the object is indexed: index name -> value """
+        return {}
+
     def key_from_arguments(self, *args, **kwargs):
         """ get the key from the arguments """
         raise NotImplementedError
@@ -1,6 +1,11 @@
+import concurrent.futures
+import io
+import json
 import os
 import subprocess
 import sys
+import threading
+import time
 
 from . import structure_base
 from . import structure_host
@@ -17,6 +22,10 @@ class Connections(structure_base.Collection):
         """ get the key from the arguments """
         return source, dest, path
 
+    def index_values(self, obj):
+        """ connections are indexed by source and destination """
+        return {"source": obj.source, "dest": obj.dest}
+
     def obj_to_raw_data(self, obj):
         """ converts an object into raw data """
         raw = dict(obj._data)
@@ -35,6 +44,144 @@ class Connections(structure_base.Collection):
         # build dictionary
         return raw
 
+    def probe(self, connections):
+        """
+            checks concurrently which of the given connections are online,
+            the results are stored in the cache used by is_online
+        """
+        # only probe connections whose status is not yet known
+        connections = [c for c in connections if not c.always_on and not hasattr(c, "_isonline_cache")]
+
+        # use the recently stored status, if available
+        for connection in connections:
+            isonline = self.app.reachability.get(connection)
+            if isonline is not None:
+                connection._isonline_cache = isonline
+
+        connections = [c for c in connections if not hasattr(c, "_isonline_cache")]
+        if not connections:
+            return
+
+        # probe all connections at once
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            statuses = list(executor.map(lambda c: c.timed_probe(), connections))
+
+        for connection, (isonline, latency) in sorted(zip(connections, statuses), key=lambda cs: cs[0].path):
+            # cache and store it
+            connection._isonline_cache = isonline
+            self.app.reachability.record(connection, isonline, latency)
+            # report the status of ssh connections
+            if connection.protocol() == "ssh":
+                print("checking ssh connection to server '%s'... %s"
+                      % (connection.path_data()["server"], "online" if isonline else "offline"))
+
+        # persist the results
+        self.app.reachability.save()
+
+
+class ReachabilityStore:
+    """
+        persistent store of the last probe result of every ssh connection
+        (status, timestamp and latency), stored results are only used if
+        they are younger than ttl seconds
+    """
+
+    FILENAME = "connection_reachability"
+
+    def __init__(self, app, ttl=0, refresh=False):
+        # save options
+        self.app = app
+        self.ttl = ttl
+        self.refresh = refresh
+        # entries are loaded on first use
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.app.path, self.FILENAME)
+
+    @staticmethod
+    def key(connection):
+        """ the key under which the status of the connection is stored """
+        return "%s->%s:%s" % (connection.source.name, connection.dest.name, connection.path)
+
+    def _load(self):
+        """ loads the stored entries """
+        if self._entries is None:
+            try:
+                with io.open(self.path, mode="rt", encoding="UTF8") as fd:
+                    self._entries = json.load(fd)
+            except (IOError, ValueError):
+                # a missing or broken store is an empty store
+                self._entries = {}
+        return self._entries
+
+    def get(self, connection):
+        """ returns the stored status of the connection if it is recent enough, otherwise None """
+        # only ssh connections are stored, everything else is cheap to check
+        if self.refresh or self.ttl <= 0 or connection.protocol() != "ssh":
+            return None
+
+        with self._lock:
+            entry = self._load().get(self.key(connection))
+
+        if entry is None:
+            return None
+
+        # check the age of the entry
+        age = time.time() - entry["timestamp"]
+        if not 0 <= age <= self.ttl:
+            return None
+
+        return entry["online"]
+
+    def record(self, connection, online, latency):
+        """ records the result of a probe """
+        if connection.protocol() != "ssh":
+            return
+
+        with self._lock:
+            self._load()[self.key(connection)] = {
+                "online": online,
+                "timestamp": time.time(),
+                "latency": latency,
+            }
+
+    def save(self):
+        """ saves the store, merged with the entries stored by concurrent runs in the meantime """
+        with self._lock:
+            if self._entries is None:
+                return
+            entries = dict(self._entries)
+
+        # merge with the current content of the file, the most recent entry wins
+        try:
+            with io.open(self.path, mode="rt", encoding="UTF8") as fd:
+                stored = json.load(fd)
+        except (IOError, ValueError):
+            stored = {}
+        if isinstance(stored, dict):
+            for key, entry in stored.items():
+                try:
+                    if key not in entries or entry["timestamp"] > entries[key]["timestamp"]:
+                        entries[key] = entry
+                except (KeyError, TypeError):
+                    # ignore broken entries
+                    pass
+
+        raw_json = json.dumps(entries, ensure_ascii=False, indent=4, sort_keys=True)
+
+        # write to a temporary file and rename it, so concurrent runs never see a partial file
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with io.open(tmp_path, mode="wt", encoding="UTF8") as fd:
+                fd.write(raw_json)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # the store is a cache only
+            pass
+
 
 class Connection:
     """ encodes information of one connection """
@@ -75,7 +222,30 @@ class Connection:
 
     @always_on.setter
     def always_on(self, v):
-        self._data["alwayson"] = str(bool(v)).lower()
+        self._set_data("alwayson", str(bool(v)).lower())
+
+    @property
+    def jobs(self):
+        """ maximal number of parallel transfers over the connection, default: None (unlimited) """
+        jobs = self._data.get("jobs")
+        return int(jobs) if jobs is not None else None
+
+    @jobs.setter
+    def jobs(self, v):
+        if v is not None:
+            assert int(v) >= 1, "%s: jobs has to be a positive number" % self
+            v = str(int(v))
+        self._set_data("jobs", v)
+
+    def _set_data(self, name, v):
+        """ sets (or deletes if v is None) a property and marks the connection as changed """
+        if self._data.get(name) == v:
+            return
+        if v is None:
+            del self._data[name]
+        else:
+            self._data[name] = v
+        self.app.connections.changed(self)
 
     #
     # derived methods
@@ -118,43 +288,81 @@ class Connection:
         else:
             raise ValueError("Programming error.")
 
-    def is_online(self):
-        """ checks if the connection is online """
-        # if always on is set, then the connection is online
-        if self.always_on:
-            return True
+    def timeout_options(self):
+        """ ssh options which limit the time needed to connect to the server """
+        if self.app.connect_timeout is None:
+            return []
+        return ["-o", "ConnectTimeout=%d" % self.app.connect_timeout]
 
-        # if there is a cache, use it
-        if hasattr(self, "_isonline_cache"):
-            return self._isonline_cache
+    def ssh_options(self):
+        """ options passed to ssh when connecting to the server """
+        # route the session through the shared master connection (if there is one)
+        return self.app.ssh_pool.options() + self.timeout_options()
 
+    def probe(self):
+        """ checks if the connection is online (ignoring the cache) """
         # get data
         data = self.path_data()
 
         if data["protocol"] == "mount":
             # consider a path mounted if the directory exists and is non-empty
-            if os.path.isdir(self.path) and os.listdir(self.path):
-                isonline = True
-            else:
-                isonline = False
+            return bool(os.path.isdir(self.path) and os.listdir(self.path))
         elif data["protocol"] == "ssh":
+            # start the shared master connection, if the server cannot be reached, it is offline,
+            # if the master fails for another reason (e.g. the server asks for a password),
+            # the probe connects directly
+            if self.app.ssh_pool.enabled and not self.app.ssh_pool.start(data["server"], self.timeout_options()):
+                if self.app.ssh_pool.unreachable(data["server"]):
+                    return False
+
             try:
-                # run 'ssh <server> echo test'
-                print("checking ssh connection to server '%s'... " % data["server"], end="")
-                # flush the above statement
-                sys.stdout.flush()
+                # run 'ssh <server> help'
+                cmd = ["ssh"] + self.ssh_options() + [data["server"], "help"]
                 with open(os.devnull, "w") as devnull:
-                    subprocess.check_output(["ssh", data["server"], "help"], stderr=devnull)
+                    subprocess.check_output(cmd, stderr=devnull)
                 # if it succeeds, say the connection is online
-                isonline = True
-                print("online")
+                return True
             except subprocess.CalledProcessError:
-                # otherwise, it is not only
-                isonline = False
-                print("offline")
+                # otherwise, it is not online
+                return False
         else:
             raise ValueError("Programming error.")
 
+    def timed_probe(self):
+        """ checks if the connection is online, returns the status and the latency in seconds """
+        start = time.time()
+        isonline = self.probe()
+        return isonline, time.time() - start
+
+    def is_online(self):
+        """ checks if the connection is online """
+        # if always on is set, then the connection is online
+        if self.always_on:
+            return True
+
+        # if there is a cache, use it
+        if hasattr(self, "_isonline_cache"):
+            return self._isonline_cache
+
+        # if there is a recent result in the persistent store, use it
+        isonline = self.app.reachability.get(self)
+        if isonline is not None:
+            self._isonline_cache = isonline
+            return isonline
+
+        if self.protocol() == "ssh":
+            print("checking ssh connection to server '%s'... " % self.path_data()["server"], end="")
+            # flush the above statement
+            sys.stdout.flush()
+
+        isonline, latency = self.timed_probe()
+
+        if self.protocol() == "ssh":
+            print("online" if isonline else "offline")
+            # persist it
+            self.app.reachability.record(self, isonline, latency)
+            self.app.reachability.save()
+
         # cache it
         self._isonline_cache = isonline
         # return status
@@ -187,17 +395,37 @@ class Connection:
         # we can do that only if the protocol is 'ssh'
         return self.protocol() in ("ssh",)
 
-    def execute_remotely(self, cmd, ignore_exception=False, print_ignored_exception=True):
-        """ execute the command on the target machine """
+    def remote_command(self, cmd):
+        """ build the local command which executes cmd on the target machine """
         assert self.supports_remote_execution(), "does not support remote execution"
         assert isinstance(cmd, list), "expected a list"
 
+        server = self.path_data()["server"]
+
+        # make sure that the shared master connection is running
+        self.app.ssh_pool.start(server, self.timeout_options())
+
+        return ["ssh"] + self.ssh_options() + [server] + cmd
+
+    def execute_remotely(self, cmd, ignore_exception=False, print_ignored_exception=True):
+        """ execute the command on the target machine """
         # build remote command
-        l_cmd = ["ssh", self.path_data()["server"]] + cmd
+        l_cmd = self.remote_command(cmd)
 
         # execute the command
         self.app.execute_command(l_cmd, ignore_exception=ignore_exception, print_ignored_exception=print_ignored_exception)
 
+    def execute_remotely_streamed(self, cmd):
+        """
+            execute the command on the target machine, the output is prefixed
+            with the name of the target host, returns the exit status
+        """
+        # build remote command
+        l_cmd = self.remote_command(cmd)
+
+        # execute the command
+        return self.app.execute_command_streamed(l_cmd, prefix="[%s] " % self.dest.name)
+
     #
     # hashable type mehods, hashable is needed for dict keys and sets
     # (source: http://docs.python.org/2/library/stdtypes.html#mapping-types-dict)
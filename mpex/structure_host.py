@@ -59,11 +59,11 @@ class Host:
 
     def repositories(self):
         """ return the repositories on the current machine """
-        return {repo for repo in self.app.repositories.get_all() if repo.host == self}
+        return self.app.repositories.find("host", self)
 
     def connections(self):
         """ return the connections from the current machine """
-        return {conn for conn in self.app.connections.get_all() if conn.source == self}
+        return self.app.connections.find("source", self)
 
     #
     # hashable type methods, hashable is needed for dict keys and sets
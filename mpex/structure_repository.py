@@ -22,6 +22,10 @@ class Repositories(structure_base.Collection):
         assert isinstance(host, structure_host.Host), "host %s has to be an instance of Host" % host
         return annex, data.get("description", host.name)
 
+    def index_values(self, obj):
+        """ repositories are indexed by host and annex """
+        return {"host": obj.host, "annex": obj.annex}
+
     def obj_to_raw_data(self, obj):
         """ converts an object into raw data """
         raw = dict(obj._data)
@@ -40,16 +44,21 @@ class Repositories(structure_base.Collection):
         # build dictionary
         return raw
 
-    def check(self):
-        """ checks the files expressions """
-        for repo in self.get_all():
+    def check(self, annexes=None):
+        """ checks the files expressions (of the repositories of the given annexes, default: all) """
+        if annexes is None:
+            repositories = self.get_all()
+        else:
+            repositories = {repo for annex in annexes for repo in self.find("annex", annex)}
+
+        for repo in repositories:
             repo.files = repo.files
 
     def fuzzy_match(self, annex, annex_desc):
         """ matches the annex description in a fuzzy way against the known repositories """
 
         # create key -> value mapping
-        valid = {repo.description: repo for repo in self.get_all() if repo.annex == annex}
+        valid = {repo.description: repo for repo in self.find("annex", annex)}
 
         try:
             # try to find a
@@ -270,7 +279,7 @@ class Repository:
 
     @direct.setter
     def direct(self, v):
-        self._data["direct"] = str(bool(v)).lower()
+        self._set_data("direct", str(bool(v)).lower())
 
     @property
     def trust(self):
@@ -280,7 +289,7 @@ class Repository:
     @trust.setter
     def trust(self, v):
         assert v in self.TRUST_LEVEL, "Trust has to be valid, is '%s'." % v
-        self._data["trust"] = v
+        self._set_data("trust", v)
 
     @property
     def files(self):
@@ -292,15 +301,12 @@ class Repository:
     @files.setter
     def files(self, v):
         """ protected setter method """
-        # sanitise the expression
-        v = self.sanitise_files_expression(v)
+        # sanitise the expression (None deletes the property)
+        self._set_data("files", self.sanitise_files_expression(v))
 
-        if v is None and "files" in self._data:
-            # if it should be deleted and the property is set
-            del self._data["files"]
-        elif v is not None:
-            # if the property should be set
-            self._data["files"] = v
+    def tokenised_files(self):
+        """ tokenise the current files expression """
+        return self._tokenise_files_expression(self.files)
 
     def files_as_cmd(self):
         """ convert the current files expression to a command """
@@ -313,7 +319,17 @@ class Repository:
 
     @strict.setter
     def strict(self, v):
-        self._data["strict"] = str(bool(v)).lower()
+        self._set_data("strict", str(bool(v)).lower())
+
+    def _set_data(self, name, v):
+        """ sets (or deletes if v is None) a property and marks the repository as changed """
+        if self._data.get(name) == v:
+            return
+        if v is None:
+            del self._data[name]
+        else:
+            self._data[name] = v
+        self.app.repositories.changed(self)
 
     def is_special(self):
         """ determines if the repository is a special remote """
@@ -0,0 +1,222 @@
+import collections
+import re
+import subprocess
+
+
+class FilesExpressionMatcher:
+    """
+        evaluates a tokenised files expression (see Repository) against the set
+        of uuids which hold a file, it mirrors git-annex's matcher: operators are
+        applied from left to right without precedence, '&' is implicit between
+        two operands and '-' negates the following operand
+    """
+
+    # matches everything (the empty expression)
+    ANY = ("any",)
+
+    def __init__(self, tokens, uuids):
+        """ tokens: tokenised files expression, uuids: description -> uuid """
+        self.uuids = uuids
+
+        if list(tokens) == ["-"]:
+            # special case: no file should be in the repository
+            self.tree = ("none",)
+        else:
+            self.tree, _ = self._process(list(tokens), 0)
+
+    def missing_descriptions(self):
+        """ returns the descriptions used in the expression whose uuid is unknown """
+        missing = set()
+
+        def visit(tree):
+            if tree[0] == "in" and tree[1] not in self.uuids:
+                missing.add(tree[1])
+            for child in tree[1:]:
+                if isinstance(child, tuple):
+                    visit(child)
+
+        visit(self.tree)
+        return missing
+
+    def _process(self, tokens, pos):
+        """ parses tokens from pos until the end or a closing bracket, returns (tree, pos) """
+        tree = self.ANY
+        while pos < len(tokens) and tokens[pos] != ")":
+            tree, pos = self._consume(tree, tokens, pos)
+        return tree, pos
+
+    def _consume(self, tree, tokens, pos):
+        """ combines tree with the next operand, returns (tree, pos) """
+        if pos >= len(tokens):
+            return tree, pos
+
+        token = tokens[pos]
+        if token == "&":
+            operand, pos = self._consume(self.ANY, tokens, pos + 1)
+            return ("and", tree, operand), pos
+        elif token == "+":
+            operand, pos = self._consume(self.ANY, tokens, pos + 1)
+            return ("or", tree, operand), pos
+        elif token == "-":
+            operand, pos = self._consume(self.ANY, tokens, pos + 1)
+            return ("and", tree, ("not", operand)), pos
+        elif token == "(":
+            group, pos = self._process(tokens, pos + 1)
+            # skip the closing bracket
+            return ("and", tree, group), pos + 1
+        else:
+            # a repository description
+            return ("and", tree, ("in", token)), pos + 1
+
+    def _evaluate(self, tree, locations):
+        operator = tree[0]
+        if operator == "any":
+            return True
+        elif operator == "none":
+            return False
+        elif operator == "in":
+            return self.uuids.get(tree[1]) in locations
+        elif operator == "not":
+            return not self._evaluate(tree[1], locations)
+        elif operator == "and":
+            return self._evaluate(tree[1], locations) and self._evaluate(tree[2], locations)
+        elif operator == "or":
+            return self._evaluate(tree[1], locations) or self._evaluate(tree[2], locations)
+        else:
+            raise ValueError("Programming error: %s" % operator)
+
+    def __call__(self, locations):
+        """ does a file which is present in the given uuids match the expression? """
+        return self._evaluate(self.tree, locations)
+
+
+def parse_uuid_log(raw):
+    """
+        parse the uuid.log of the git-annex branch, lines have the form
+        '<uuid> <description> [timestamp=<time>s]', returns a dictionary
+        uuid -> description (the most recent description wins)
+    """
+    descriptions = {}
+    timestamps = {}
+
+    for line in raw.decode("UTF-8", errors="replace").splitlines():
+        uuid, _, rest = line.strip().partition(" ")
+        if not uuid:
+            continue
+
+        # split off the timestamp
+        timestamp = 0.0
+        match = re.match(r"^(.*?) ?timestamp=([0-9.]+)s?$", rest)
+        if match:
+            rest, timestamp = match.group(1), float(match.group(2))
+
+        if timestamp >= timestamps.get(uuid, timestamp):
+            descriptions[uuid], timestamps[uuid] = rest, timestamp
+
+    return descriptions
+
+
+def read_uuid_descriptions(path):
+    """ read uuid -> description from the git-annex branch of the repository at path """
+    process = subprocess.Popen(["git", "cat-file", "-p", "refs/heads/git-annex:uuid.log"],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=path)
+    output, _ = process.communicate()
+    return parse_uuid_log(output) if process.returncode == 0 else {}
+
+
+class TransferPlan:
+    """
+        the transfers and drops which are needed to bring all repositories into
+        their desired state, None stands for the local repository
+    """
+
+    def __init__(self):
+        # (source, destination) -> list of files
+        self.transfers = collections.OrderedDict()
+        # (source, destination) -> [bytes, files of unknown size]
+        self.transfer_bytes = collections.OrderedDict()
+        # repository -> list of files
+        self.drops = collections.OrderedDict()
+
+    def add_transfer(self, filepath, source, destination, size=None):
+        self.transfers.setdefault((source, destination), []).append(filepath)
+        totals = self.transfer_bytes.setdefault((source, destination), [0, 0])
+        if size is None:
+            totals[1] += 1
+        else:
+            totals[0] += size
+
+    def add_drop(self, filepath, repository):
+        self.drops.setdefault(repository, []).append(filepath)
+
+    def transfer_count(self):
+        return sum(len(files) for files in self.transfers.values())
+
+    def drop_count(self):
+        return sum(len(files) for files in self.drops.values())
+
+    def estimate(self):
+        """ returns the list of (source, destination, files, bytes, files of unknown size) """
+        return [(source, destination, len(self.transfers[source, destination]), size, unknown)
+                for (source, destination), (size, unknown) in self.transfer_bytes.items()]
+
+
+def plan_transfers(files, here, local_matcher, remotes, strict, sizes=None):
+    """
+        computes the transfers which 'git-annex copy' would do when called per remote:
+        first pull from all remotes, then push to all remotes and then apply strict
+        - files: dictionary filepath -> uuids holding the file
+        - here: uuid of the local repository
+        - local_matcher: matcher of the local files expression
+        - remotes: list of (remote, uuid, matcher, strict), in the order of execution
+        - strict: apply strict for the local repository
+        - sizes: dictionary filepath -> size of the file (None if unknown), optional
+    """
+    plan = TransferPlan()
+    if sizes is None:
+        sizes = {}
+
+    for filepath in sorted(files):
+        locations = set(files[filepath])
+        size = sizes.get(filepath)
+
+        # pull: the first remote which has the file delivers it
+        if here not in locations and local_matcher(locations):
+            for remote, uuid, _, _ in remotes:
+                if uuid in locations:
+                    plan.add_transfer(filepath, remote, None, size)
+                    locations.add(here)
+                    break
+
+        # push: only possible if the file is present locally
+        if here in locations:
+            for remote, uuid, matcher, _ in remotes:
+                if uuid not in locations and matcher(locations):
+                    plan.add_transfer(filepath, None, remote, size)
+                    locations.add(uuid)
+
+        # apply strict for the local repository
+        if strict and here in locations and not local_matcher(locations):
+            plan.add_drop(filepath, None)
+            locations.discard(here)
+
+        # apply strict for the remote repositories
+        for remote, uuid, matcher, remote_strict in remotes:
+            if remote_strict and uuid in locations and not matcher(locations):
+                plan.add_drop(filepath, remote)
+                locations.discard(uuid)
+
+    return plan
+
+
+def chunks(files, max_length=65536):
+    """ split the list of files into chunks which fit on a command line """
+    chunk, length = [], 0
+    for filepath in files:
+        if chunk and length + len(filepath) + 1 > max_length:
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(filepath)
+        length += len(filepath) + 1
+    if chunk:
+        yield chunk
@@ -1,10 +1,23 @@
+import contextlib
+import io
 import itertools
+import json
 import os.path
 import subprocess
+import sys
 import tempfile
 import unittest
+import unittest.mock
 
 from mpex import application
+from mpex import grouped_repositories
+from mpex import local_repository
+from mpex import location_index
+from mpex import redundancy
+from mpex import structure_connection
+from mpex import transfer_planner
+from mpex.lib import parallel
+from mpex.lib import ssh_pool
 
 # show everything, errors may hide in the output branches
 verbose = 0
@@ -37,6 +50,25 @@ class TestStructure(unittest.TestCase):
         app = application.Application(self.path, verbose=self.verbose)
         self.assertIsNotNone(app)
 
+    def test_lazy_app_creation(self):
+        """ a lazy application loads the collections on first use and checks only what it is told """
+        app = application.Application(self.path, verbose=self.verbose)
+        host1, annex1, annex2 = app.hosts.create("Host1"), app.annexes.create("Annex1"), app.annexes.create("Annex2")
+        app.repositories.create(host1, annex1, "/repo1", files="Host1")
+        app.repositories.create(host1, annex2, "/repo2", files="Unknown")
+        app.save()
+
+        self.assertRaises(ValueError, application.Application, self.path, verbose=self.verbose)
+
+        app = application.Application(self.path, verbose=self.verbose, lazy=True)
+        self.assertEqual({host.name for host in app.hosts.get_all()}, {"Host1"})
+        self.assertIsNone(app._repositories)
+        annex1 = app.annexes.get("Annex1")
+        self.assertEqual(len(annex1.repositories()), 1)
+        self.assertIsNone(app._connections)
+        app.repositories.check([annex1])
+        self.assertRaises(ValueError, app.repositories.check, [app.annexes.get("Annex2")])
+
     def test_hosts_creation(self):
         """ test host creation and identity """
         # initialisation
@@ -120,6 +152,43 @@ class TestStructure(unittest.TestCase):
         repr(repo11)
         str(repo11)
 
+    def test_indexes(self):
+        """ the indexes follow creation, edits and removal """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2 = h.create("Host1"), h.create("Host2")
+        annex1, annex2 = a.create("Annex1"), a.create("Annex2")
+        repo11 = r.create(host1, annex1, "/repo11")
+        repo12 = r.create(host1, annex2, "/repo12")
+        repo21 = r.create(host2, annex1, "/repo21")
+        conn12 = c.create(host1, host2, "/mnt")
+
+        self.assertEqual(host1.repositories(), {repo11, repo12})
+        self.assertEqual(annex1.repositories(), {repo11, repo21})
+        self.assertEqual(host1.connections(), {conn12})
+        self.assertEqual(host2.connections(), set())
+        self.assertEqual(c.find("dest", host2), {conn12})
+
+        # an (unsafe) edit moves the object to another host
+        repo12._host = host2
+        r.changed(repo12)
+        self.assertEqual(host1.repositories(), {repo11})
+        self.assertEqual(host2.repositories(), {repo12, repo21})
+
+        r.remove(repo21)
+        self.assertEqual(annex1.repositories(), {repo11})
+
+        # renaming a host or an annex (unsafe edit) keeps the lookups working
+        host1._name = "Host3"
+        annex1._name = "Annex3"
+        app.rekey()
+        self.assertIs(h.get("Host3"), host1)
+        self.assertEqual(host1.repositories(), {repo11})
+        self.assertEqual(host1.connections(), {conn12})
+        self.assertEqual(annex1.repositories(), {repo11})
+        self.assertIs(r.get(host1, annex1, "/repo11"), repo11)
+        self.assertIs(c.get(host1, host2, "/mnt"), conn12)
+
     def test_creation_repositories_error_cases(self):
         """ """
         # initialisation
@@ -368,6 +437,28 @@ class TestStructure(unittest.TestCase):
         conn13.always_on = False
         self.assertFalse(conn13.always_on)
 
+    def test_connection_metadata_jobs(self):
+        """ test jobs """
+        # initialisation
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2, host3 = [h.create("Host%d" % i) for i in range(1, 4)]
+
+        # jobs
+        conn12 = c.create(host1, host2, "/")
+        self.assertIsNone(conn12.jobs)
+        conn12.jobs = 4
+        self.assertEqual(conn12.jobs, 4)
+        self.assertEqual(conn12._data["jobs"], "4")
+        conn12.jobs = None
+        self.assertIsNone(conn12.jobs)
+        self.assertNotIn("jobs", conn12._data)
+
+        conn13 = c.create(host1, host3, "/", jobs="2")
+        self.assertEqual(conn13.jobs, 2)
+        with self.assertRaises(AssertionError):
+            conn13.jobs = 0
+
     def test_connection_metadata_protocol(self):
         """ test protocol and pathData """
         # initialisation
@@ -438,6 +529,223 @@ class TestStructure(unittest.TestCase):
         # second time comes from cache
         self.assertFalse(conn.is_online())
 
+    def test_connection_probe(self):
+        """ test probing several connections at once """
+        app = application.Application(self.path, verbose=self.verbose, connect_timeout=1)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2, host3, host4 = [h.create("Host%d" % i) for i in range(1, 5)]
+
+        # a mounted connection
+        conn12 = c.create(host1, host2, os.path.join(self.path, "repo"))
+        os.makedirs(conn12.path)
+        with open(os.path.join(conn12.path, "test"), "wt") as fd:
+            fd.write("test")
+        # a connection with a server which does not exist
+        conn13 = c.create(host1, host3, "ssh://127.0.0.1:53122")
+        self.assertEqual(conn13.ssh_options(), ["-o", "ConnectTimeout=1"])
+        # an always on connection
+        conn14 = c.create(host1, host4, "ssh://127.0.0.1:53122/", alwayson="true")
+
+        # probe all
+        c.probe(host1.connections())
+
+        # the cache is filled
+        self.assertTrue(conn12._isonline_cache)
+        self.assertFalse(conn13._isonline_cache)
+        self.assertFalse(hasattr(conn14, "_isonline_cache"))
+        self.assertTrue(conn12.is_online())
+        self.assertFalse(conn13.is_online())
+        self.assertTrue(conn14.is_online())
+
+    def test_connection_probe_failed_master(self):
+        """ a server without master is offline if it cannot be reached, otherwise it is probed directly """
+        app = application.Application(self.path, verbose=self.verbose, connect_timeout=1, ssh_multiplexing=True)
+        h, c = app.hosts, app.connections
+        conn = c.create(h.create("Host1"), h.create("Host2"), "ssh://myserver")
+        app.ssh_pool.start = lambda server, options: False
+
+        sessions = []
+        with unittest.mock.patch.object(subprocess, "check_output", lambda cmd, **kwargs: sessions.append(cmd)):
+            # no second attempt to connect
+            app.ssh_pool.unreachable = lambda server: True
+            self.assertFalse(conn.probe())
+            self.assertEqual(sessions, [])
+
+            # e.g. the server asks for a password
+            app.ssh_pool.unreachable = lambda server: False
+            self.assertTrue(conn.probe())
+            self.assertEqual(sessions[0][-2:], ["myserver", "help"])
+
+    def test_connection_reachability_store(self):
+        """ test that the status of ssh connections is persisted """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2 = h.create("Host1"), h.create("Host2")
+
+        # connection with a server which does not exist, but pretend it was online
+        conn = c.create(host1, host2, "ssh://127.0.0.1:53122")
+        app.reachability.record(conn, True, 0.25)
+        app.reachability.save()
+        app.save()
+
+        # a recent entry is used
+        app = application.Application(self.path, verbose=self.verbose, connection_ttl=60)
+        conn = app.connections.get(app.hosts.get("Host1"), app.hosts.get("Host2"), "ssh://127.0.0.1:53122")
+        self.assertTrue(conn.is_online())
+
+        # unless the connections should be refreshed, the result is then stored
+        app = application.Application(self.path, verbose=self.verbose, connection_ttl=60, refresh_connections=True)
+        conn = app.connections.get(app.hosts.get("Host1"), app.hosts.get("Host2"), "ssh://127.0.0.1:53122")
+        self.assertFalse(conn.is_online())
+
+        app = application.Application(self.path, verbose=self.verbose, connection_ttl=60)
+        conn = app.connections.get(app.hosts.get("Host1"), app.hosts.get("Host2"), "ssh://127.0.0.1:53122")
+        self.assertFalse(app.reachability.get(conn))
+
+        # without a time to live, the store is not used
+        app.reachability.record(conn, True, 0.25)
+        app.reachability.ttl = 0
+        self.assertIsNone(app.reachability.get(conn))
+
+    def test_connection_reachability_store_merge(self):
+        """ concurrent runs keep the entries of each other """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, c = app.hosts, app.connections
+        host1, host2, host3 = h.create("Host1"), h.create("Host2"), h.create("Host3")
+        conn12 = c.create(host1, host2, "ssh://127.0.0.1:53122")
+        conn13 = c.create(host1, host3, "ssh://127.0.0.1:53123")
+
+        # two runs which loaded the (empty) store before either of them saved
+        store1 = structure_connection.ReachabilityStore(app, ttl=60)
+        store2 = structure_connection.ReachabilityStore(app, ttl=60)
+        store1.record(conn12, True, 0.25)
+        store2.record(conn13, True, 0.5)
+        store1.save()
+        store2.save()
+
+        store = structure_connection.ReachabilityStore(app, ttl=60)
+        self.assertTrue(store.get(conn12))
+        self.assertTrue(store.get(conn13))
+
+        # an unwritable store is not an error
+        missing = type("App", (), {"path": os.path.join(self.path, "missing")})()
+        store = structure_connection.ReachabilityStore(missing, ttl=60)
+        store.record(conn12, True, 0.25)
+        store.save()
+
+    def test_config_store_migration(self):
+        """ the configuration can be converted between one file per object and a snapshot """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2, annex1 = h.create("Host1"), h.create("Host2"), a.create("Annex1")
+        r.create(host1, annex1, "/repo", files="Host1")
+        c.create(host1, host2, "/mnt", jobs="2")
+        app.save()
+
+        def stored():
+            app = application.Application(self.path, verbose=self.verbose)
+            return [sorted(map(repr, collection.items())) for collection in app.collections()]
+
+        files = stored()
+        self.assertEqual(app.config_store.layout(), "files")
+
+        # to a snapshot, the per object files are removed
+        app.migrate_config_store("snapshot")
+        self.assertEqual(app.config_store.layout(), "snapshot")
+        self.assertEqual([filename for filename in os.listdir(self.path) if filename.startswith("known_")], [])
+        self.assertIn("config_snapshot.json", os.listdir(self.path))
+        self.assertEqual(stored(), files)
+
+        # changes are saved in the snapshot
+        app = application.Application(self.path, verbose=self.verbose)
+        host3 = app.hosts.create("Host3")
+        app.repositories.create(host3, app.annexes.get("Annex1"), "/repo3")
+        # the snapshot is written once per save
+        writes, write_snapshot = [], app.config_store._write_snapshot
+        app.config_store._write_snapshot = lambda: writes.append(1) or write_snapshot()
+        app.save()
+        self.assertEqual(len(writes), 1)
+        app = application.Application(self.path, verbose=self.verbose)
+        self.assertEqual(sorted(host.name for host in app.hosts.get_all()), ["Host1", "Host2", "Host3"])
+
+        # and back again
+        app.migrate_config_store("files")
+        self.assertEqual(app.config_store.layout(), "files")
+        self.assertNotIn("config_snapshot.json", os.listdir(self.path))
+        self.assertEqual(len(stored()[0]), 3)
+        self.assertEqual(stored()[3], files[3])
+
+    def test_incremental_save(self):
+        """ only created, changed and removed objects are written """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2, annex1 = h.create("Host1"), h.create("Host2"), a.create("Annex1")
+        repo1 = r.create(host1, annex1, "/repo1")
+        repo2 = r.create(host2, annex1, "/repo2")
+        app.save()
+
+        def modification_times():
+            return {filename: os.stat(os.path.join(self.path, filename)).st_mtime_ns
+                    for filename in os.listdir(self.path)}
+
+        # nothing changed, nothing is written
+        before = modification_times()
+        os.utime(self.path)
+        app = application.Application(self.path, verbose=self.verbose)
+        repo1 = app.repositories.get(app.hosts.get("Host1"), app.annexes.get("Annex1"), "/repo1")
+        repo1.files = repo1.files
+        self.assertFalse(app.repositories._changed)
+        app.save()
+        self.assertEqual(modification_times(), before)
+
+        # a changed object replaces its file
+        repo1.trust = "trust"
+        app.save()
+        after = modification_times()
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(len(set(after) - set(before)), 1)
+
+        # a removed object deletes its file
+        app.repositories.remove(repo1)
+        app.save()
+        self.assertEqual(len(os.listdir(self.path)), len(before) - 1)
+
+        app = application.Application(self.path, verbose=self.verbose)
+        self.assertEqual([repo.path for repo in app.repositories.get_all()], ["/repo2"])
+
+    def test_rename_save(self):
+        """ renaming a host or an annex saves the objects referring to it as well """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2, annex1 = h.create("H1"), h.create("H2"), a.create("A1")
+        r.create(host1, annex1, "/repo")
+        c.create(host2, host1, "/mnt")
+        app.save()
+
+        app = application.Application(self.path, verbose=self.verbose)
+        host1, annex1 = app.hosts.get("H1"), app.annexes.get("A1")
+        host1._name = "H3"
+        app.edited(host1)
+        annex1._name = "A3"
+        app.edited(annex1)
+        app.save()
+
+        app = application.Application(self.path, verbose=self.verbose)
+        self.assertEqual(sorted(host.name for host in app.hosts.get_all()), ["H2", "H3"])
+        self.assertEqual([annex.name for annex in app.annexes.get_all()], ["A3"])
+        repo, = app.repositories.get_all()
+        self.assertEqual((repo.host.name, repo.annex.name), ("H3", "A3"))
+        conn, = app.connections.get_all()
+        self.assertEqual((conn.source.name, conn.dest.name), ("H2", "H3"))
+        self.assertEqual(app.hosts.get("H3").repositories(), {repo})
+
+    def test_normalise_config_key(self):
+        """ test the normalisation of git config keys """
+        normalise = local_repository.GitRepository.normalise_config_key
+        self.assertEqual(normalise("annex.UUID"), "annex.uuid")
+        self.assertEqual(normalise("Remote.Host1.URL"), "remote.Host1.url")
+        self.assertEqual(normalise("remote.host.example.com.url"), "remote.host.example.com.url")
+
     def test_connection_pathOnSource(self):
         """ test the pathOnSource method for connections with protocol 'ssh' """
         app = application.Application(self.path, verbose=self.verbose)
@@ -480,6 +788,24 @@ class TestStructure(unittest.TestCase):
         conn23.execute_remotely(["ls"])
         self.assertEqual(subroutine_called, [True])
 
+    def test_connection_remote_execution_streamed(self):
+        """ test the executeRemotelyStreamed method """
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, host2 = h.create("Host1"), h.create("Host2")
+
+        # create connection
+        conn12 = c.create(host1, host2, "ssh://myserver")
+
+        # we can only check the resulting command, so overwrite app.executeCommandStreamed
+        def check_execute_command_streamed(cmd, prefix):
+            self.assertEqual(cmd, ["ssh", "myserver", "mpex", "sync"])
+            self.assertEqual(prefix, "[Host2] ")
+            return 3
+
+        app.execute_command_streamed = check_execute_command_streamed
+        self.assertEqual(conn12.execute_remotely_streamed(["mpex", "sync"]), 3)
+
     def test_relations(self):
         """
             test Host's repositories and connections methods as well as
@@ -617,6 +943,602 @@ class TestStructure(unittest.TestCase):
         capabilities2 = app.git_annex_capabilities
         self.assertEqual(id(capabilities), id(capabilities2))
 
+    def test_app_gitAnnexCapabilities_persistent(self):
+        """ the capabilities are stored until git-annex changes """
+        app = application.Application(self.path, verbose=self.verbose)
+        capabilities = app.git_annex_capabilities
+        with open(app.git_annex_capabilities_path) as fd:
+            raw_data = json.load(fd)
+        self.assertEqual(raw_data["stamp"], app.git_annex_stamp())
+
+        # a new application uses the stored capabilities
+        raw_data["capabilities"]["version"] = "stored"
+        with open(app.git_annex_capabilities_path, "w") as fd:
+            json.dump(raw_data, fd)
+        app = application.Application(self.path, verbose=self.verbose)
+        self.assertEqual(app.git_annex_capabilities["version"], "stored")
+        self.assertEqual(app.git_annex_capabilities["date"], capabilities["date"])
+
+        # unless git-annex was replaced
+        raw_data["stamp"]["mtime"] -= 1
+        with open(app.git_annex_capabilities_path, "w") as fd:
+            json.dump(raw_data, fd)
+        app = application.Application(self.path, verbose=self.verbose)
+        self.assertEqual(app.git_annex_capabilities, capabilities)
+
+        # a broken cache is ignored
+        stamp = app.git_annex_stamp()
+        for broken in ([], {"stamp": stamp}, {"stamp": stamp, "capabilities": {"date": 1}},
+                       {"stamp": stamp, "capabilities": {"version": "x", "date": [2020, 1, 1]}}):
+            with open(app.git_annex_capabilities_path, "w") as fd:
+                json.dump(broken, fd)
+            app = application.Application(self.path, verbose=self.verbose)
+            self.assertEqual(app.git_annex_capabilities, capabilities)
+
+
+class TestParallel(unittest.TestCase):
+    """
+        tests the parallel execution helpers
+    """
+
+    def test_run_parallel_buffers_output(self):
+        """ the output of every item is printed in one piece """
+        output = io.StringIO()
+
+        def f(item):
+            for i in range(50):
+                print(item, i)
+
+        with contextlib.redirect_stdout(output):
+            failures = parallel.run_parallel(["a", "b", "c"], f, 3)
+
+        self.assertEqual(failures, [])
+        lines = output.getvalue().splitlines()
+        # the lines of each item are consecutive
+        for k in range(3):
+            block = lines[50 * k:50 * (k + 1)]
+            self.assertEqual(len({line.split()[0] for line in block}), 1)
+            self.assertEqual([line.split()[1] for line in block], [str(i) for i in range(50)])
+
+    def test_run_parallel_failures(self):
+        """ failures are collected and do not stop the other items """
+        done = []
+
+        def f(item):
+            if item % 2:
+                raise application.InterruptedException("failed %d" % item)
+            done.append(item)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            failures = parallel.run_parallel(range(6), f, 2)
+
+        self.assertCountEqual(done, [0, 2, 4])
+        self.assertEqual([item for item, _ in failures], [1, 3, 5])
+        self.assertIn("failed 3", str(failures[1][1]))
+
+    def test_run_parallel_nested(self):
+        """ the output of nested calls ends up in the buffer of the outer item """
+        output = io.StringIO()
+
+        def inner(item):
+            print("inner", item)
+
+        def outer(item):
+            print("outer", item)
+            parallel.run_parallel([item + "1", item + "2"], inner, 2)
+
+        with contextlib.redirect_stdout(output):
+            failures = parallel.run_parallel(["a", "b"], outer, 2)
+
+        self.assertEqual(failures, [])
+        lines = output.getvalue().splitlines()
+        self.assertCountEqual(lines[:3], ["outer a", "inner a1", "inner a2"] if lines[0] == "outer a"
+                              else ["outer b", "inner b1", "inner b2"])
+        self.assertEqual(len(lines), 6)
+
+    def test_check_call_buffered(self):
+        """ the output of commands is captured into the thread buffer """
+        output = io.StringIO()
+
+        def f(item):
+            parallel.check_call(["echo", "item%d" % item])
+
+        with contextlib.redirect_stdout(output):
+            failures = parallel.run_parallel(range(3), f, 3)
+
+        self.assertEqual(failures, [])
+        self.assertEqual(sorted(output.getvalue().split()), ["item0", "item1", "item2"])
+
+    def test_call_prefixed(self):
+        """ every line is prefixed and the exit status is returned """
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            status = parallel.call_prefixed(["sh", "-c", "echo a; echo b >&2; exit 3"], "[Host1] ")
+
+        self.assertEqual(status, 3)
+        self.assertEqual(output.getvalue().splitlines(), ["[Host1] a", "[Host1] b"])
+
+        # quiet: only stderr is shown
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            status = parallel.call_prefixed(["sh", "-c", "echo a; echo b >&2"], "[Host1] ", quiet=True)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(output.getvalue().splitlines(), ["[Host1] b"])
+
+
+class TestSSHPool(unittest.TestCase):
+    """
+        tests the ssh connection pool
+    """
+
+    def test_disabled(self):
+        """ a disabled pool does not change anything """
+        pool = ssh_pool.SSHPool(enabled=False)
+        self.assertEqual(pool.options(), [])
+        self.assertIsNone(pool.environment())
+        self.assertFalse(pool.start("myserver"))
+
+    def test_enabled(self):
+        """ sessions are routed through the control socket """
+        pool = ssh_pool.SSHPool()
+        options = pool.options()
+        self.assertEqual(options[:1], ["-o"])
+        self.assertTrue(options[1].startswith("ControlPath="))
+
+        env = pool.environment()
+        if "GIT_SSH_COMMAND" not in os.environ:
+            self.assertIn("ControlPath=", env["GIT_SSH_COMMAND"])
+
+        # an unreachable server has no master
+        self.assertFalse(pool.start("127.0.0.1:53122", ["-o", "ConnectTimeout=1"]))
+        self.assertTrue(pool.unreachable("127.0.0.1:53122"))
+        self.assertFalse(pool.unreachable("myserver"))
+        # without a master, ssh connects directly, git still uses the pool
+        self.assertEqual(pool.options(), options)
+        if "GIT_SSH_COMMAND" not in os.environ:
+            self.assertIn("ControlPath=", pool.environment()["GIT_SSH_COMMAND"])
+
+        # the socket directory is removed
+        directory = os.path.dirname(options[1][len("ControlPath="):])
+        self.assertTrue(os.path.isdir(directory))
+        pool.close()
+        self.assertFalse(os.path.isdir(directory))
+
+
+class TestGroupedRepositories(unittest.TestCase):
+    """
+        tests the whereis report
+    """
+
+    whereis = [
+        b'{"file":"a/x","whereis":[{"uuid":"u1","description":"one"}],"untrusted":[]}\n',
+        b'{"file":"a/y","whereis":[{"uuid":"u1","description":"one"}],'
+        b'"untrusted":[{"uuid":"u2","description":"two"}]}\n',
+        b'\n',
+        b'{"file":"b/c/z","whereis":[{"uuid":"u1","description":"one"},{"uuid":"u3","description":"three"}],'
+        b'"untrusted":[]}\n',
+    ]
+
+    def test_parse_annex_whereis(self):
+        """ the raw output and a stream of lines give the same result """
+        files, repositories = grouped_repositories.parse_annex_whereis(b"".join(self.whereis))
+        self.assertEqual(files, {"a/x": {"u1"}, "a/y": {"u1", "u2"}, "b/c/z": {"u1", "u3"}})
+        self.assertEqual(repositories, {"u1": "one", "u2": "two [untrusted]", "u3": "three"})
+        self.assertEqual(grouped_repositories.parse_annex_whereis(iter(self.whereis)), (files, repositories))
+
+        files, repositories = grouped_repositories.parse_annex_whereis(self.whereis, omit_untrusted=True)
+        self.assertEqual(files["a/y"], {"u1"})
+        # equal location sets are shared
+        self.assertIs(files["a/x"], files["a/y"])
+        self.assertNotIn("u2", repositories)
+
+    def test_full_split(self):
+        """ split file paths into directories and file name """
+        self.assertEqual(grouped_repositories.full_split("x"), ([], "x"))
+        self.assertEqual(grouped_repositories.full_split("a/b/x"), (["a", "b"], "x"))
+        self.assertEqual(grouped_repositories.full_split("a//b/x"), (["a", "b"], "x"))
+
+    def test_location_sets(self):
+        """ location sets are interned to bitmasks """
+        location_sets = grouped_repositories.LocationSets()
+        ab, b, ba = [location_sets.intern(uuids) for uuids in (["a", "b"], ["b"], ["b", "a"])]
+        self.assertEqual(ab, ba)
+        self.assertNotEqual(ab, b)
+        self.assertEqual(len(location_sets), 2)
+        self.assertEqual(location_sets.mask(ab), 0b11)
+        self.assertEqual(location_sets.mask(b), 0b10)
+        self.assertEqual(location_sets.uuids(ab), {"a", "b"})
+        self.assertEqual(location_sets.uuids(location_sets.intern([])), frozenset())
+
+    def test_stream_annex_whereis(self):
+        """ a failing whereis raises an error, files without copies do not """
+        directory = tempfile.mkdtemp()
+        script = os.path.join(directory, "git-annex")
+        path = os.environ["PATH"]
+        os.environ["PATH"] = directory + os.pathsep + path
+        try:
+            def run(body):
+                with open(script, "w") as fd:
+                    fd.write("#!/bin/sh\n" + body)
+                os.chmod(script, 0o755)
+                return list(grouped_repositories.stream_annex_whereis(directory))
+
+            with self.assertRaises(subprocess.CalledProcessError) as context:
+                run("echo 'not a git repository' >&2; exit 1\n")
+            self.assertIn(b"not a git repository", context.exception.stderr)
+
+            self.assertEqual(run("echo '{}'; echo 'whereis: 1 failed' >&2; exit 1\n"), [b"{}\n"])
+        finally:
+            os.environ["PATH"] = path
+
+    def test_group_files_hierarchical(self):
+        """ the tree is built from the stream """
+        repositories = {}
+        files = grouped_repositories.iterate_annex_whereis(self.whereis, repositories)
+        root = grouped_repositories.group_files_hierarchical(files)
+        self.assertEqual(root.get_file_count(), 3)
+        self.assertEqual(sorted(root.dirs), ["a", "b"])
+        self.assertIs(root.get_subfolder(["b", "c"]), root.dirs["b"].dirs["c"])
+
+        description = root.get_description()
+        self.assertEqual(description[frozenset(["u1"])], ["a/x"])
+        self.assertEqual(description[frozenset(["u1", "u2"])], ["a/y"])
+        self.assertEqual([d.get_name() for d in description[frozenset(["u1", "u3"])]], ["b"])
+
+        # the aggregates are updated when files are added
+        self.assertEqual(root.dirs["b"].get_file_count(), 1)
+        root.get_subfolder(["b", "c"]).add_file(frozenset(["u1"]), "b/c/w")
+        self.assertEqual(root.get_file_count(), 4)
+        self.assertEqual(root.dirs["b"].get_description()[frozenset(["u1"])], ["b/c/w"])
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            grouped_repositories.print_report(root, repositories)
+        self.assertIn("(1 files, 1 of unknown size)", output.getvalue())
+
+    def test_sizes(self):
+        """ the sizes are taken from the keys and summed up per directory and location set """
+        files = [("a/x", frozenset(["u1"]), "SHA256E-s1000--x"),
+                 ("a/y", frozenset(["u1"]), "SHA256E-s2048--y"),
+                 ("b/z", frozenset(["u1", "u2"]), "URL--z")]
+        root = grouped_repositories.group_files_hierarchical(files)
+        self.assertEqual(root.get_byte_count(), 3048)
+        self.assertEqual(root.dirs["b"].get_byte_count(), 0)
+
+        totals = root.location_totals()
+        self.assertEqual(totals[root.location_sets.intern(["u1"])], [2, 3048, 0])
+        self.assertEqual(totals[root.location_sets.intern(["u1", "u2"])], [1, 0, 1])
+        self.assertEqual(root.get_unknown_count(), 1)
+
+        # the totals follow new files
+        root.get_subfolder(["a"]).add_file(frozenset(["u1"]), "a/w", 52)
+        self.assertEqual(root.dirs["a"].get_byte_count(), 3100)
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            grouped_repositories.print_report(root, {"u1": "one", "u2": "two"})
+        self.assertIn("(3 files, 3.0 KiB)", output.getvalue())
+        self.assertIn("(1 files, 1 of unknown size)", output.getvalue())
+
+
+class TestLocationIndex(unittest.TestCase):
+    """
+        tests reading the location logs from the git-annex branch
+    """
+
+    def git(self, *args, env=None):
+        cmd = ["git", "-c", "user.name=mpex", "-c", "user.email=mpex@localhost"] + list(args)
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(cmd, cwd=self.path, stderr=devnull, env=env).decode().strip()
+
+    def write(self, filename, content):
+        filepath = os.path.join(self.path, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "w") as fd:
+            fd.write(content)
+
+    def commit_branch(self):
+        """ commit the content of the directory 'branch' to the git-annex branch """
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(self.path, ".git", "test-annex-index"))
+        self.git("--work-tree=branch", "add", "-A", ".", env=env)
+        tree = self.git("write-tree", env=env)
+        parent = subprocess.call(["git", "rev-parse", "-q", "--verify", "git-annex"], cwd=self.path,
+                                 stdout=subprocess.DEVNULL)
+        parents = ["-p", "git-annex"] if parent == 0 else []
+        commit = self.git("commit-tree", tree, *parents, "-m", "branch")
+        self.git("update-ref", "refs/heads/git-annex", commit)
+
+    def setUp(self):
+        # create a git repository which looks like an annex
+        self.path = tempfile.mkdtemp()
+        self.git("init", "-q")
+        os.makedirs(os.path.join(self.path, "a"))
+        os.symlink("../.git/annex/objects/Xx/Yy/KEY-1/KEY-1", os.path.join(self.path, "a", "x"))
+        os.symlink("elsewhere", os.path.join(self.path, "link"))
+        self.write("p", "/annex/objects/KEY-2\n")
+        self.write("normal.txt", "hello\n")
+        self.git("add", "a", "link", "p", "normal.txt")
+        self.git("commit", "-q", "-m", "files")
+
+        # and its git-annex branch
+        self.write("branch/uuid.log", "u1 one timestamp=1s\nu2 two timestamp=1s\nu3 three timestamp=1s\n")
+        self.write("branch/trust.log", "u2 0 timestamp=1s\nu3 X timestamp=1s\n")
+        self.write("branch/7a1/0c2/KEY-1.log", "1s 1 u1\n1s 1 u2\n2s 0 u1\n3s 1 u1\n1s 1 u3\n")
+        self.write("branch/3f0/d4e/KEY-2.log", "1s 1 u2\n2s 0 u2\n")
+        self.commit_branch()
+
+    def test_cat_file_batch(self):
+        """ requests without object are answered without asking git, in order """
+        # a ref with a name which used to stand for missing objects
+        self.git("tag", "missing")
+        requests = [("a", None), ("b", "HEAD:normal.txt"), ("c", None), ("d", "HEAD:unknown"), ("e", None)]
+        self.assertEqual(list(location_index.cat_file_batch(self.path, requests)),
+                         [("a", None), ("b", b"hello\n"), ("c", None), ("d", None), ("e", None)])
+        self.assertEqual(list(location_index.cat_file_batch(self.path, [("a", None)])), [("a", None)])
+
+    def test_parse_logs(self):
+        """ the most recent entry decides """
+        self.assertEqual(location_index.parse_location_log(b"1s 1 u1\n2s 0 u1\n1s 1 u2\n"), {"u2"})
+        self.assertEqual(location_index.parse_trust_log(b"u1 1 timestamp=2s\nu1 0 timestamp=1s\nu2 X\n"),
+                         {"u1": "1", "u2": "X"})
+
+    def test_key_size(self):
+        """ the size is encoded in the key """
+        self.assertEqual(location_index.key_size("SHA256E-s1234--abc.jpg"), 1234)
+        self.assertEqual(location_index.key_size("SHA256E-s0-m12--abc"), 0)
+        self.assertEqual(location_index.key_size("WORM-m12-s7--name-s99"), 7)
+        self.assertIsNone(location_index.key_size("URL--http&c%%example.com%file-s12"))
+        self.assertIsNone(location_index.key_size(None))
+
+    def test_key_from_blob(self):
+        """ symbolic links and pointer files point to keys """
+        self.assertEqual(location_index.key_from_blob("120000", b"../.git/annex/objects/a/b/KEY/KEY"), "KEY")
+        self.assertIsNone(location_index.key_from_blob("120000", b"../somewhere/else"))
+        self.assertEqual(location_index.key_from_blob("100644", b"/annex/objects/KEY\n"), "KEY")
+        self.assertIsNone(location_index.key_from_blob("100644", b"hello"))
+        self.assertIsNone(location_index.key_from_blob("100644", None))
+
+    def test_read_branch_locations(self):
+        """ the locations of all annexed files are read from the branch """
+        repositories = {}
+        files = dict(location_index.read_branch_locations(self.path, repositories))
+        self.assertEqual(files, {"a/x": ["u1", "u2"], "p": []})
+        self.assertEqual(repositories, {"u1": "one", "u2": "two [untrusted]"})
+
+        files = dict(location_index.read_branch_locations(self.path, {}, omit_untrusted=True))
+        self.assertEqual(files, {"a/x": ["u1"], "p": []})
+
+        files = sorted(location_index.read_branch_locations(self.path, {}, with_keys=True))
+        self.assertEqual(files, [("a/x", ["u1", "u2"], "KEY-1"), ("p", [], "KEY-2")])
+        self.assertEqual(sorted(location_index.read_cached_locations(self.path, {}, with_keys=True)), files)
+
+        # the report can be created from the branch
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            grouped_repositories.do_report(self.path, source="branch")
+        self.assertIn("(1 files, 1 of unknown size)", output.getvalue())
+
+    def test_combined_report(self):
+        """ several annexes are grouped into one tree """
+        repositories = {}
+        root = grouped_repositories.group_annexes([("A", self.path), ("B", self.path)], repositories,
+                                                  source="branch", jobs=2)
+        self.assertEqual(sorted(root.dirs), ["A", "B"])
+        self.assertEqual(root.get_file_count(), 4)
+        self.assertEqual(root.get_subfolder(["B", "a"]).names, ["x"])
+
+        summary = grouped_repositories.summarise_annexes(root, repositories)
+        self.assertEqual(summary["files"], 4)
+        self.assertEqual(summary["annexes"]["A"]["files"], 2)
+        self.assertCountEqual(summary["location_sets"],
+                              [{"uuids": ["u1", "u2"], "repositories": ["one", "two [untrusted]"],
+                                "files": 2, "bytes": 0, "unknown_size_files": 2},
+                               {"uuids": [], "repositories": [], "files": 2, "bytes": 0, "unknown_size_files": 2}])
+
+        summary_path = os.path.join(self.path, "summary.json")
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            grouped_repositories.do_combined_report([("A", self.path)], source="branch", summary_path=summary_path)
+        self.assertIn("A/a/ (1 files, 1 of unknown size)", output.getvalue())
+        with open(summary_path) as fd:
+            self.assertEqual(json.load(fd)["annexes"]["A"]["files"], 2)
+
+        # the summary is not mixed with the records
+        self.assertRaises(ValueError, grouped_repositories.do_combined_report, [("A", self.path)], source="branch",
+                          summary_path="-", output_format="jsonl")
+
+    def test_combined_report_same_annex(self):
+        """ several repositories of one annex are kept apart """
+        repositories = {}
+        other = os.path.join(self.path, ".")
+        root = grouped_repositories.group_annexes([("A", self.path), ("A", other)], repositories, source="branch")
+        self.assertEqual(sorted(root.dirs), sorted(["A (%s)" % self.path, "A (%s)" % other]))
+        self.assertEqual(root.get_file_count(), 4)
+        self.assertEqual(root.get_subfolder(["A (%s)" % self.path, "a"]).names, ["x"])
+
+    def test_export(self):
+        """ the complete report is written as JSON lines and CSV """
+        repositories = {}
+        root = grouped_repositories.group_annexes([("A", self.path), ("B", self.path)], repositories,
+                                                  source="branch")
+        records = list(grouped_repositories.report_records(root, repositories))
+        self.assertEqual([(r["type"], r["path"], r["files"]) for r in records],
+                         [("location_set", None, 2), ("file", "A/p", 1), ("file", "B/p", 1),
+                          ("location_set", None, 2), ("directory", "A/a/", 1), ("directory", "B/a/", 1)])
+        self.assertEqual(records[4]["repositories"], ["one", "two [untrusted]"])
+
+        stream = io.StringIO()
+        grouped_repositories.write_records(records, stream, "jsonl")
+        self.assertEqual([json.loads(line) for line in stream.getvalue().splitlines()], records)
+
+        stream = io.StringIO()
+        grouped_repositories.write_records(records, stream, "csv")
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[0], "annex,type,path,files,bytes,unknown_size_files,uuids,repositories")
+        self.assertEqual(lines[2], ",file,A/p,1,,1,,")
+        self.assertEqual(lines[5], ",directory,A/a/,1,0,1,u1;u2,one;two [untrusted]")
+        self.assertEqual(len(lines), 7)
+
+        # single files are reported with their size, if it is known
+        root = grouped_repositories.group_files_hierarchical([("d/f", ["u1"], "SHA256E-s1234--f"),
+                                                              ("d/g", [], "SHA256E-s10--g"),
+                                                              ("d/h", ["u1"], "SHA256E-s5--h"),
+                                                              ("d/i", ["u1"], "URL--i")])
+        records = list(grouped_repositories.report_records(root, {}))
+        self.assertEqual([(r["type"], r["path"], r["bytes"], r["unknown_size_files"]) for r in records],
+                         [("location_set", None, 1239, 1), ("file", "d/f", 1234, 0), ("file", "d/h", 5, 0),
+                          ("file", "d/i", None, 1), ("location_set", None, 10, 0), ("file", "d/g", 10, 0)])
+
+        # the reports of single repositories carry the annex, the header is only written once
+        stream = io.StringIO()
+        with contextlib.redirect_stdout(stream):
+            grouped_repositories.write_records([], sys.stdout, "csv")
+            grouped_repositories.do_report(self.path, source="branch", output_format="csv", annex="A",
+                                           header=False)
+            grouped_repositories.do_report(self.path, source="branch", output_format="csv", annex="A",
+                                           header=False)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines.count("annex,type,path,files,bytes,unknown_size_files,uuids,repositories"), 1)
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(lines[1:5], lines[5:])
+        self.assertTrue(all(line.startswith("A,") for line in lines[1:]))
+
+    def test_snapshot(self):
+        """ the snapshot follows HEAD and the git-annex branch """
+        def read():
+            return dict(location_index.read_cached_locations(self.path, {}))
+
+        snapshot = location_index.LocationSnapshot(self.path)
+        self.assertIsNone(snapshot.load())
+        self.assertEqual(read(), {"a/x": ["u1", "u2"], "p": []})
+        self.assertEqual(snapshot.load()["locations"], {"KEY-1": ["u1", "u2", "u3"], "KEY-2": []})
+
+        # unchanged: the snapshot is used as it is
+        data = snapshot.load()
+        data["locations"]["KEY-2"] = ["u1"]
+        snapshot.save(data)
+        self.assertEqual(read(), {"a/x": ["u1", "u2"], "p": ["u1"]})
+
+        # move both commits
+        os.symlink("../.git/annex/objects/Xx/Yy/KEY-3/KEY-3", os.path.join(self.path, "a", "y"))
+        self.git("rm", "-q", "p")
+        self.git("add", "a/y")
+        self.git("commit", "-q", "-m", "change")
+        self.write("branch/7a1/0c2/KEY-1.log", "1s 0 u1\n1s 1 u2\n")
+        self.write("branch/111/222/KEY-3.log", "1s 1 u1\n")
+        self.commit_branch()
+
+        expected = {"a/x": ["u2"], "a/y": ["u1"]}
+        self.assertEqual(read(), expected)
+        self.assertEqual(dict(location_index.read_branch_locations(self.path, {})), expected)
+        self.assertEqual(snapshot.load()["locations"], {"KEY-1": ["u2"], "KEY-3": ["u1"]})
+
+        # an unusable snapshot is rebuilt
+        data = snapshot.load()
+        data["head"] = "0" * 40
+        snapshot.save(data)
+        self.assertEqual(read(), expected)
+
+
+class TestRedundancy(unittest.TestCase):
+    """
+        tests the redundancy analysis
+    """
+
+    def test_analysis(self):
+        """ files are categorised by their location sets """
+        trust = {"t": "trust", "s": "semitrust", "u": "untrust"}
+        analysis = redundancy.RedundancyAnalysis(trust, numcopies=2, depth=1)
+        analysis.add_all([("a/b/1", ["t", "s"], "SHA256E-s10--x"),
+                          ("a/b/2", ["t"], "SHA256E-s20--x"),
+                          ("a/3", ["u"], "SHA256E-s30--x"),
+                          ("c/4", [], "SHA256E-s40--x"),
+                          ("5", ["unknown"], "URL--x"),
+                          ("c/6", ["s", "t"], "SHA256E-s1--x")])
+
+        self.assertEqual(analysis.totals, {redundancy.LOST: [1, 40, 0],
+                                           redundancy.UNTRUSTED_ONLY: [1, 30, 0],
+                                           redundancy.UNDER_REPLICATED: [2, 20, 1],
+                                           redundancy.SAFE: [2, 11, 0]})
+        # the risk is judged once per location set
+        self.assertEqual(len(analysis.location_sets), 5)
+        self.assertEqual(analysis.at_risk(), [("c", redundancy.LOST, 1, 40, 0),
+                                              ("a", redundancy.UNTRUSTED_ONLY, 1, 30, 0),
+                                              ("a", redundancy.UNDER_REPLICATED, 1, 20, 0),
+                                              (".", redundancy.UNDER_REPLICATED, 1, 0, 1)])
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            redundancy.print_analysis(analysis, 2)
+        self.assertIn("lost:             1 files, 40 B", output.getvalue())
+        self.assertIn("<omitted 2 directories>", output.getvalue())
+
+    def test_format_size(self):
+        self.assertEqual(grouped_repositories.format_size(1023), "1023 B")
+        self.assertEqual(grouped_repositories.format_size(1536), "1.5 KiB")
+        self.assertEqual(grouped_repositories.format_size(3 * 1024 ** 3), "3.0 GiB")
+
+
+class TestTransferPlanner(unittest.TestCase):
+    """
+        tests the transfer planner used by copy
+    """
+
+    uuids = {"alice": "uuid-a", "bob": "uuid-b", "share": "uuid-s"}
+
+    def matcher(self, tokens):
+        return transfer_planner.FilesExpressionMatcher(tokens, self.uuids)
+
+    def test_matcher(self):
+        """ the matcher evaluates from left to right like git-annex """
+        self.assertTrue(self.matcher([])(set()))
+        self.assertFalse(self.matcher(["-"])({"uuid-a"}))
+        self.assertTrue(self.matcher(["alice"])({"uuid-a"}))
+        self.assertFalse(self.matcher(["alice"])({"uuid-b"}))
+        self.assertTrue(self.matcher(["alice", "-", "bob"])({"uuid-a"}))
+        self.assertFalse(self.matcher(["alice", "-", "bob"])({"uuid-a", "uuid-b"}))
+        # no precedence: (alice + bob) & share
+        matcher = self.matcher(["alice", "+", "bob", "&", "share"])
+        self.assertFalse(matcher({"uuid-a"}))
+        self.assertTrue(matcher({"uuid-b", "uuid-s"}))
+        matcher = self.matcher(["(", "alice", "-", "bob", ")", "+", "(", "bob", "-", "alice", ")"])
+        self.assertTrue(matcher({"uuid-a"}))
+        self.assertTrue(matcher({"uuid-b"}))
+        self.assertFalse(matcher({"uuid-a", "uuid-b"}))
+        # unknown descriptions are reported
+        self.assertEqual(self.matcher(["alice", "+", "carol"]).missing_descriptions(), {"carol"})
+
+    def test_parse_uuid_log(self):
+        """ the most recent description wins """
+        raw = b"uuid-a alice timestamp=10.5s\nuuid-a new alice timestamp=20s\nuuid-b bob\n"
+        self.assertEqual(transfer_planner.parse_uuid_log(raw), {"uuid-a": "new alice", "uuid-b": "bob"})
+
+    def test_plan_transfers(self):
+        """ pull, push and strict are planned like the per repository commands """
+        files = {"a": ["uuid-a"], "b": ["uuid-b"], "ab": ["uuid-a", "uuid-b"], "s": ["uuid-s", "uuid-b"]}
+        share = self.matcher(["(", "alice", "-", "bob", ")", "+", "(", "bob", "-", "alice", ")"])
+        remotes = [("bob", "uuid-b", self.matcher([]), False), ("share", "uuid-s", share, True)]
+
+        # copy in alice
+        plan = transfer_planner.plan_transfers(files, "uuid-a", self.matcher([]), remotes, False)
+        self.assertEqual(dict(plan.transfers), {("bob", None): ["b", "s"], (None, "bob"): ["a"]})
+        self.assertEqual(dict(plan.drops), {"share": ["s"]})
+        self.assertEqual((plan.transfer_count(), plan.drop_count()), (3, 1))
+        self.assertEqual(sorted(plan.estimate(), key=str), [("bob", None, 2, 0, 2), (None, "bob", 1, 0, 1)])
+
+        # the estimate sums up the known sizes
+        sizes = {"a": 100, "b": 20, "s": None}
+        plan = transfer_planner.plan_transfers(files, "uuid-a", self.matcher([]), remotes, False, sizes)
+        self.assertEqual(sorted(plan.estimate(), key=str), [("bob", None, 2, 20, 1), (None, "bob", 1, 100, 0)])
+
+        # local strict
+        plan = transfer_planner.plan_transfers(files, "uuid-a", self.matcher(["-"]), remotes[:1], True)
+        self.assertEqual(dict(plan.transfers), {(None, "bob"): ["a"]})
+        self.assertEqual(dict(plan.drops), {None: ["a", "ab"]})
+
+    def test_chunks(self):
+        """ chunks respect the maximal length """
+        self.assertEqual(list(transfer_planner.chunks(["aa", "bb", "cc"], max_length=6)), [["aa", "bb"], ["cc"]])
+        self.assertEqual(list(transfer_planner.chunks([])), [])
+
 
 # noinspection PyUnusedLocal
 class TestCommands(unittest.TestCase):
@@ -812,6 +1734,91 @@ class TestCommands(unittest.TestCase):
         self.assertEqual(repo.on_disk_direct_mode(), "indirect")
         self.assertEqual(repo.on_disk_trust_level(), "semitrust")
 
+    def test_init_parallel(self):
+        """ init several repositories in parallel without changing the working directory """
+        # initialisation
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1 = h.create("Host1")
+        annexes = [a.create("Annex%d" % i) for i in range(1, 5)]
+
+        # set host
+        app.set_current_host(host1)
+
+        # create
+        repos = [app.assimilate(r.create(host1, annex, os.path.join(self.path, "repo-%s" % annex.name)))
+                 for annex in annexes]
+
+        # init in parallel
+        cwd = os.getcwd()
+        failures = parallel.run_parallel(repos, lambda repo: repo.init(), 4)
+        self.assertEqual(failures, [])
+        self.assertEqual(os.getcwd(), cwd)
+
+        # check properties
+        for repo in repos:
+            self.assertTrue(os.path.isdir(os.path.join(repo.path, ".git/annex")))
+            self.assertEqual(repo.on_disk_description(), "Host1")
+
+    def test_git_config_snapshot(self):
+        """ test that git config values are read at once and the snapshot is invalidated """
+        # initialisation
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, annex1 = h.create("Host1"), a.create("Annex1")
+
+        # set host
+        app.set_current_host(host1)
+
+        # create & init
+        repo = r.create(host1, annex1, os.path.join(self.path, "repo"))
+        repo = app.assimilate(repo)
+        repo.init()
+
+        # compare with git config
+        uuid = subprocess.check_output(["git", "config", "annex.uuid"], cwd=repo.path).decode("UTF8").strip()
+        self.assertEqual(repo.git_config("annex.uuid"), uuid)
+        self.assertEqual(repo.git_config("ANNEX.UUID"), uuid)
+        self.assertIsNone(repo.git_config("remote.MyRemote.url"))
+        self.assertEqual(repo.git_config("remote.MyRemote.url", "default"), "default")
+
+        # the snapshot is cached
+        self.assertIs(repo.git_config_snapshot(), repo.git_config_snapshot())
+
+        # commands run by mpex invalidate the snapshot
+        repo.execute_command(["git", "remote", "add", "MyRemote", "/abc"])
+        self.assertEqual(repo.git_config("remote.MyRemote.url"), "/abc")
+        self.assertIsNone(repo.git_config("remote.myremote.url"))
+
+    def test_metadata_cache(self):
+        """ test that git-annex metadata is cached until mpex runs the next command """
+        # initialisation
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, annex1 = h.create("Host1"), a.create("Annex1")
+
+        # set host
+        app.set_current_host(host1)
+
+        # create & init
+        repo = r.create(host1, annex1, os.path.join(self.path, "repo"))
+        repo = app.assimilate(repo)
+        repo.init()
+
+        # the info is only read once
+        self.assertIs(repo.git_annex_info(), repo.git_annex_info())
+        self.assertEqual(repo.on_disk_description(), "Host1")
+        self.assertIn("master", repo.git_branch())
+
+        # commands run by mpex invalidate the cache
+        info = repo.git_annex_info()
+        repo.execute_command(["git-annex", "describe", "here", "Changed"])
+        self.assertIsNot(repo.git_annex_info(), info)
+        self.assertEqual(repo.on_disk_description(), "Changed")
+
+        repo.execute_command(["git", "remote", "add", "MyRemote", "/abc"])
+        self.assertIn("MyRemote", repo.git_remotes())
+
     def test_set_properties_direct(self):
         """ test repository setProperties with direct mode"""
         # initialisation
@@ -908,9 +1915,10 @@ class TestCommands(unittest.TestCase):
         repo1.set_properties()
 
         # check remotes
-        self.assertIn("Host2", subprocess.check_output(["git", "remote", "show"]).decode("UTF8"))
-        self.assertIn("Host3", subprocess.check_output(["git", "remote", "show"]).decode("UTF8"))
-        self.assertNotIn("Host4", subprocess.check_output(["git", "remote", "show"]).decode("UTF8"))
+        remotes = subprocess.check_output(["git", "remote", "show"], cwd=repo1.path).decode("UTF8")
+        self.assertIn("Host2", remotes)
+        self.assertIn("Host3", remotes)
+        self.assertNotIn("Host4", remotes)
         with open(os.path.join(repo1.path, ".git/config")) as fd:
             x = fd.read()
             self.assertIn("/abc" + repo2.path, x)
@@ -1093,6 +2101,47 @@ class TestCommands(unittest.TestCase):
         # should not raise an exception
         repo.repair_master()
 
+    def test_sync_skipped_if_unchanged(self):
+        """ a second sync without changes does not run any command """
+        # initialisation
+        app = application.Application(self.path, verbose=self.verbose)
+        h, a, r, c = app.hosts, app.annexes, app.repositories, app.connections
+        host1, annex = h.create("Host1"), a.create("Annex")
+        # set host
+        app.set_current_host(host1)
+
+        # create & init
+        repo = r.create(host1, annex, os.path.join(self.path, "repo"))
+        repo = app.assimilate(repo)
+        repo.init()
+        repo.sync()
+
+        # record executed commands
+        executed = []
+        execute_command = app.execute_command
+
+        def recording_execute_command(cmd, **kwargs):
+            executed.append(cmd)
+            execute_command(cmd, **kwargs)
+
+        app.execute_command = recording_execute_command
+
+        # nothing changed
+        repo.sync()
+        self.assertEqual(executed, [])
+
+        # change the working tree
+        self.create_file(repo, "test")
+        repo.sync()
+        self.assertIn(["git-annex", "add"], executed)
+        self.has_link(repo, "test")
+
+        # nothing changed again
+        del executed[:]
+        repo.sync()
+        repo.finalise()
+        self.assertEqual(executed, [])
+
     def sync_tester(self, direct):
         """
             test sync with the given direct mode
@@ -1783,6 +2832,10 @@ class TestCommands(unittest.TestCase):
         repo1._data["description"] = "abel"
         repo2._data["description"] = "eve"
 
+        # only marked objects are saved
+        for obj in [host1, host2, repo1.repo, repo2.repo]:
+            app.edited(obj)
+
         # restart app
         for x in [h, a, r, c]:
             x.save()